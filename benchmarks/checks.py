@@ -0,0 +1,202 @@
+"""
+Behavioural checks of the GenePattern Notebook extension, run end to end against a local fake GenePattern
+server (see server.py). Each check starts its own server, so that checks don't depend on each other.
+Exits with a non-zero status if any check fails.
+
+Run from the repository root, optionally naming the checks to run, as the checks workflow in
+.github/workflows does on every push:
+
+    python benchmarks/checks.py redirect_cache_expiry
+
+Requires the packages in setup.py to be installed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Check this checkout
+from server import FakeGenePattern
+
+
+CHECKS = {}  # Map of check names -> function(), in the order they are run
+
+
+def check(function):
+    """Register a check function, which raises AssertionError if the check fails"""
+    CHECKS[function.__name__] = function
+    return function
+
+
+def wait_for(condition, timeout=5.0, interval=0.005):
+    """Wait until the condition is true, returning False if it takes longer than the timeout"""
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end: return False
+        time.sleep(interval)
+    return True
+
+
+@check
+def redirect_cache_expiry():
+    """Redirects resolved after an earlier one expires keep their own targets"""
+    from genepattern import utils
+    server = FakeGenePattern(tasks=1, jobs=1).start()
+    ttl = utils.REDIRECT_TTL
+    try:
+        session = utils.sessions.register(server.url, 'test', 'password')
+        utils.REDIRECT_TTL = 0.05
+        first = utils.redirect_url(f'{server.url}/redirect/a', session=session)
+        time.sleep(0.1)  # Let the first entry expire, so that it is evicted when the next is cached
+        utils.REDIRECT_TTL = ttl
+        second = utils.redirect_url(f'{server.url}/redirect/b', session=session)
+        assert first.endswith('/a') and second.endswith('/b'), f'Resolved {first} and {second}'
+        assert utils.redirect_url(f'{server.url}/redirect/b', session=session) == second, 'Cached redirect for b changed'
+        assert utils.redirect_url(f'{server.url}/redirect/a', session=session).endswith('/a'), 'Redirect for a changed'
+    finally:
+        utils.REDIRECT_TTL = ttl
+        server.stop()
+
+
+def job_queries(server):
+    """Return the number of job status queries the server has received, by job list or job number"""
+    with server.lock: return sum(1 for method, path in server.requests if method == 'GET' and '/rest/v1/jobs/' in path
+                                 and '/events' not in path)
+
+
+def track_job(server, policy, job_number):
+    """Track the job with a new poller using the policy, returning the poller and the list of statuses it receives"""
+    import gp
+    from genepattern import polling, sessions
+    session = sessions.session.register(server.url, 'test', 'password')
+    poller = polling.JobPoller(session, policy)
+    statuses = []
+    poller.track(gp.GPJob(session, job_number), lambda job: statuses.append(job.info['status']['statusMessage']))
+    return poller, statuses
+
+
+@check
+def push_status_events():
+    """Job status changes pushed by the server are dispatched as they arrive, without polling"""
+    from genepattern.polling import PollingPolicy
+    server = FakeGenePattern(tasks=1, jobs=1, running=1, push=True).start()
+    try:
+        poller, statuses = track_job(server, PollingPolicy(initial=30, ceiling=60), 1)
+        assert wait_for(lambda: poller.stream.connected), 'Event stream did not connect'
+        server.set_running(1, False)
+        assert wait_for(lambda: statuses == ['Completed'], timeout=1.0), f'Status not pushed, received {statuses}'
+        assert job_queries(server) == 0, f'Job status was polled {job_queries(server)} times'
+        poller.stop()
+    finally:
+        server.stop()
+
+
+@check
+def push_unsupported_falls_back_to_polling():
+    """Servers answering the events endpoint with 400 or 404 disable push after one request, and jobs are polled"""
+    from genepattern.polling import PollingPolicy
+    for status in (400, 404):
+        server = FakeGenePattern(tasks=1, jobs=1, running=1).start()
+        server.unsupported_status = status
+        try:
+            poller, statuses = track_job(server, PollingPolicy(initial=0.05, ceiling=0.1), 1)
+            assert wait_for(lambda: not poller.stream.supported), f'Push not disabled after {status}'
+            server.set_running(1, False)
+            assert wait_for(lambda: statuses and statuses[-1] == 'Completed'), f'Status not polled after {status}'
+            assert server.count('/events') == 1, f'Events endpoint requested {server.count("/events")} times after {status}'
+            poller.stop()
+        finally:
+            server.stop()
+
+
+@check
+def push_retries_server_errors():
+    """Server errors from the events endpoint are retried with backoff, rather than disabling push"""
+    from genepattern.polling import EventStream, PollingPolicy
+    server = FakeGenePattern(tasks=1, jobs=1, running=1, push=True).start()
+    server.push_errors = [503, 502]
+    reconnect = EventStream.reconnect
+    EventStream.reconnect = PollingPolicy(initial=0.05, factor=2.0, jitter=0)
+    try:
+        poller, statuses = track_job(server, PollingPolicy(initial=30, ceiling=60), 1)
+        assert wait_for(lambda: poller.stream.connected), 'Event stream did not reconnect after server errors'
+        assert poller.stream.supported and server.count('/events') == 3, 'Unexpected event stream connections'
+        poller.stop()
+    finally:
+        EventStream.reconnect = reconnect
+        server.stop()
+
+
+@check
+def file_cache_unfinished_jobs():
+    """Status of unfinished jobs is queried at most once every recheck seconds, and copies don't share the cache's file"""
+    from genepattern import sessions
+    from genepattern.filecache import FileCache
+    server = FakeGenePattern(tasks=1, jobs=1, running=1).start()
+    try:
+        session = sessions.session.register(server.url, 'test', 'password')
+        cache = FileCache(tempfile.mkdtemp(prefix='genepattern-files-'))
+        url = f'{server.url}/jobResults/1/output0.txt'
+        assert not any(cache.cacheable(session, url) for _ in range(5)), 'Output of a running job is cacheable'
+        assert job_queries(server) == 1, f'Job status queried {job_queries(server)} times'
+        server.set_running(1, False)
+        cache.recheck = 0
+        assert cache.cacheable(session, url), 'Output of a finished job is not cacheable'
+
+        path = os.path.join(tempfile.mkdtemp(prefix='genepattern-copy-'), 'output0.txt')
+        cache.copy(session, url, path)
+        with open(path, 'ab') as f: f.write(b'changed')
+        assert os.stat(path).st_ino != os.stat(cache.lookup(session, url)).st_ino, 'Copy shares the cached file'
+        with open(cache.lookup(session, url), 'rb') as f: assert b'changed' not in f.read(), 'Cached file changed'
+    finally:
+        server.stop()
+
+
+@check
+def upload_dedup_by_name():
+    """Files with the same content but different names are each uploaded under their own name"""
+    from genepattern import sessions, transfer
+    server = FakeGenePattern(tasks=1, jobs=1).start()
+    try:
+        session = sessions.session.register(server.url, 'test', 'password')
+        folder = tempfile.mkdtemp(prefix='genepattern-uploads-')
+        urls = []
+        for name in ('a.txt', 'b.txt', 'a.txt'):
+            with open(os.path.join(folder, name), 'wb') as f: f.write(b'same content')
+            urls.append(transfer.upload_file(session, os.path.join(folder, name)))
+        assert urls[0].endswith('/a.txt') and urls[1].endswith('/b.txt'), f'Uploaded as {urls[0]} and {urls[1]}'
+        assert urls[2] == urls[0] and server.count('/data/upload/') == 2, 'Repeated upload was not deduplicated'
+
+        state = transfer.UploadState(session, 'digest', 'a.txt')
+        state.update(url=urls[0])
+        state.clear()
+        assert transfer.UploadState(session, 'digest', 'a.txt').get('url') is None, 'Cleared upload state was reloaded'
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the GenePattern Notebook extension against a fake server')
+    parser.add_argument('checks', nargs='*', help=f'checks to run, default all: {", ".join(CHECKS)}')
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown: parser.error(f'unknown checks: {", ".join(unknown)}')
+
+    # Isolate the local caches, so that results don't depend on previous runs
+    os.environ['GENEPATTERN_CACHE_DIR'] = tempfile.mkdtemp(prefix='genepattern-checks-')
+    failed = []
+    for name in args.checks or list(CHECKS):
+        try:
+            CHECKS[name]()
+            print(f'PASSED {name}')
+        except Exception:
+            print(f'FAILED {name}')
+            traceback.print_exc()
+            failed.append(name)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
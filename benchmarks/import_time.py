@@ -0,0 +1,60 @@
+"""
+Checks that importing the genepattern package stays within its import-time budget. nbtools imports the
+package at every kernel start, so the import should only register the login tool and defer everything
+else until it is used. Each measurement is made in a fresh interpreter, with nbtools already imported
+and a kernel running, as at kernel start. Exits with a non-zero status if the budget is exceeded.
+
+Run from the repository root, as the import time workflow in .github/workflows does on every push:
+
+    python benchmarks/import_time.py --budget 50
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ['gp', 'requests', 'pandas', 'numpy', 'genepattern.authwidget', 'genepattern.taskwidget',
+            'genepattern.jobwidget']  # Modules that must not be imported by importing the package
+
+
+def measure():
+    """Import the package in a fresh interpreter, returning the import time in ms and the newly imported modules"""
+    code = 'import sys, time, nbtools\n' \
+           'from ipykernel.inprocess.manager import InProcessKernelManager\n' \
+           'InProcessKernelManager().start_kernel()\n' \
+           'before = set(sys.modules)\n' \
+           'start = time.perf_counter()\n' \
+           'import genepattern\n' \
+           'print((time.perf_counter() - start) * 1000)\n' \
+           'print(" ".join(sorted(set(sys.modules) - before)))'
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    elapsed, modules = output.strip().split('\n')
+    return float(elapsed), modules.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the genepattern package')
+    parser.add_argument('--budget', type=float, default=50.0, help='maximum median import time in ms')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters to measure')
+    args = parser.parse_args()
+
+    times, modules = zip(*[measure() for _ in range(args.repeat)])
+    median = statistics.median(times)
+    eager = [m for m in DEFERRED if m in modules[0]]
+    print(f'import genepattern: {median:.1f} ms median of {args.repeat}, budget {args.budget:.1f} ms')
+
+    failed = False
+    if median > args.budget:
+        print(f'FAILED: import time exceeds the budget by {median - args.budget:.1f} ms')
+        failed = True
+    if eager:
+        print(f'FAILED: modules imported eagerly: {", ".join(eager)}')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmarks of the main user-facing paths of the GenePattern Notebook extension, run end to end against
+a local fake GenePattern server (see server.py) with an in-process IPython kernel. For each benchmark
+the wall time, number of requests, peak thread count and peak Python memory are reported.
+
+Run from the repository root, optionally naming the benchmarks to run:
+
+    python benchmarks/run.py --latency 0.02 --repeat 5 login task_widget
+
+Requires ipykernel and the packages in setup.py to be installed.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Benchmark this checkout
+from server import FakeGenePattern
+
+
+BENCHMARKS = {}  # Map of benchmark names -> function(server, session), in the order they are run
+
+
+def benchmark(function):
+    """Register a benchmark function"""
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def start_kernel():
+    """Start an in-process IPython kernel, so that widgets can be created as they would be in a notebook"""
+    from ipykernel.inprocess.manager import InProcessKernelManager
+    manager = InProcessKernelManager()
+    manager.start_kernel()
+    return manager
+
+
+def wait_for(condition, timeout=30.0, interval=0.005):
+    """Wait until the condition is true, raising TimeoutError if it takes longer than the timeout"""
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end: raise TimeoutError('Benchmark timed out waiting for condition')
+        time.sleep(interval)
+
+
+class Measurement:
+    """Context manager recording the wall time, requests, peak threads and peak memory of a block"""
+
+    def __init__(self, server):
+        self.server = server
+        self.stopped = threading.Event()
+        self.peak_threads = 0
+
+    def sample_threads(self):
+        while not self.stopped.wait(0.002):
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)  # Exclude the sampler
+
+    def __enter__(self):
+        self.server.reset()
+        self.sampler = threading.Thread(target=self.sample_threads, daemon=True)
+        self.sampler.start()
+        tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.start
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stopped.set()
+        self.sampler.join()
+        self.requests = self.server.count()
+        return False
+
+    def to_dict(self):
+        return {'wall': self.wall, 'requests': self.requests, 'threads': self.peak_threads, 'memory': self.peak_memory}
+
+
+@benchmark
+def login(server, session):
+    """GPAuthWidget login to ready: validate credentials, register modules and recent jobs"""
+    import gp
+    from genepattern import GPAuthWidget
+    from genepattern.tokens import token_manager
+    token_manager.invalidate(session)  # Measure a fresh login
+    GPAuthWidget(gp.GPServer(server.url, 'test', 'password'))
+
+
+@benchmark
+def task_widget_cold(server, session):
+    """GPTaskWidget construction with no cached task metadata"""
+    from gp import GPTask
+    from genepattern import GPTaskWidget
+    from genepattern.cache import task_cache
+    task_cache.clear()
+    GPTaskWidget(GPTask(session, next(iter(server.tasks))))
+
+
+@benchmark
+def task_widget(server, session):
+    """GPTaskWidget construction for a module that has been opened before"""
+    from gp import GPTask
+    from genepattern import GPTaskWidget
+    GPTaskWidget(GPTask(session, next(iter(server.tasks))))
+
+
+@benchmark
+def job_widget_polls(server, session):
+    """GPJobWidget poll cycles, from displaying running jobs until each has been displayed as completed"""
+    from gp import GPJob
+    from genepattern import GPJobWidget
+    numbers = [server.submit() for _ in range(10)]
+    widgets = [GPJobWidget(GPJob(session, n)) for n in numbers]
+    time.sleep(0.5)
+    for n in numbers: server.set_running(n, False)
+    wait_for(lambda: all(w.status == 'Completed' for w in widgets))
+
+
+@benchmark
+def reproduce_job(server, session):
+    """reproduce_job, creating a task widget prepopulated with the parameters of a previous job"""
+    import genepattern
+    genepattern.reproduce_job(genepattern.session, server.url, 1)
+
+
+@benchmark
+def download(server, session):
+    """Download all output files of a job"""
+    from gp import GPJob
+    from genepattern.shim import get_info
+    from genepattern.transfer import download_files
+    job = get_info(GPJob(session, 1))
+    with tempfile.TemporaryDirectory() as directory:
+        download_files(session, [(f['link']['href'], f['link']['name'], f['fileLength']) for f in job.output_files], directory)
+
+
+@benchmark
+def upload(server, session):
+    """Upload a new file, in multiple parts if larger than the part size"""
+    from genepattern.transfer import upload_file
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'input.txt')
+        with open(path, 'wb') as f: f.write(os.urandom(server.file_size))  # New content, so never deduplicated
+        upload_file(session, path)
+
+
+def run(names, repeat, server):
+    """Run the named benchmarks, returning a map of benchmark names -> list of measurement dicts"""
+    import genepattern
+    from genepattern import polling
+    polling.JobPoller.policy = polling.PollingPolicy(initial=0.1, ceiling=0.5)  # Keep poll cycles short
+    session = genepattern.session.register(server.url, 'test', 'password')
+
+    results = {}
+    for name in names:
+        results[name] = []
+        for _ in range(repeat):
+            with Measurement(server) as measurement: BENCHMARKS[name](server, session)
+            results[name].append(measurement.to_dict())
+    return results
+
+
+def report(results):
+    """Print a table of the median of each measurement"""
+    print(f'{"Benchmark":<20}{"Wall (ms)":>12}{"Requests":>10}{"Threads":>9}{"Memory (KB)":>13}')
+    for name, measurements in results.items():
+        median = {key: statistics.median(m[key] for m in measurements) for key in measurements[0]}
+        print(f'{name:<20}{median["wall"] * 1000:>12.1f}{median["requests"]:>10.0f}'
+              f'{median["threads"]:>9.0f}{median["memory"] / 1024:>13.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GenePattern Notebook extension against a fake server')
+    parser.add_argument('benchmarks', nargs='*', help=f'benchmarks to run, default all: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--repeat', type=int, default=3, help='times to run each benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of latency added to each response')
+    parser.add_argument('--tasks', type=int, default=500, help='number of modules on the server')
+    parser.add_argument('--params', type=int, default=20, help='number of parameters per module')
+    parser.add_argument('--choices', type=int, default=1000, help='number of choices for the first parameter')
+    parser.add_argument('--jobs', type=int, default=100, help='number of jobs on the server')
+    parser.add_argument('--children', type=int, default=0, help='number of child jobs per job')
+    parser.add_argument('--files', type=int, default=5, help='number of output files per job')
+    parser.add_argument('--file-size', type=int, default=4 * 1024 * 1024, help='size of files in bytes')
+    parser.add_argument('--push', action='store_true', help='stream job status events instead of only polling')
+    parser.add_argument('--json', help='also write the measurements to this JSON file')
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown: parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    # Isolate the local caches, so that results don't depend on previous runs
+    os.environ['GENEPATTERN_CACHE_DIR'] = tempfile.mkdtemp(prefix='genepattern-benchmark-')
+    server = FakeGenePattern(tasks=args.tasks, params=args.params, choices=args.choices, jobs=args.jobs,
+                             children=args.children, files=args.files, file_size=args.file_size,
+                             latency=args.latency, push=args.push).start()
+    kernel = start_kernel()
+    try:
+        results = run(args.benchmarks or list(BENCHMARKS), args.repeat, server)
+    finally:
+        kernel.shutdown_kernel()
+        server.stop()
+
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+A local stand-in for the GenePattern REST API, used by the benchmarks. It serves a configurable number of
+tasks, jobs, child jobs and output files, with an optional latency injected into every response, and
+counts the requests it receives so that benchmarks can report them. With push enabled, job status changes
+are also streamed as server-sent events; otherwise the events endpoint fails as on servers without push.
+"""
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+class FakeGenePattern:
+    """A fake GenePattern server, run in a background thread"""
+
+    def __init__(self, tasks=100, params=10, choices=0, jobs=50, children=0, files=3, file_size=1024, running=0,
+                 latency=0.0, push=False):
+        self.latency = latency          # Seconds added to every response
+        self.push = push                # Stream job status events from the events endpoint
+        self.unsupported_status = 400   # Status of the events endpoint without push, as on servers that take it for a job number
+        self.push_errors = []           # Statuses to answer the next event stream connections with, simulating server errors
+        self.file_size = file_size      # Size of each job output file in bytes
+        self.running = set()            # Job numbers still running
+        self.requests = []              # List of (method, path) of every request received
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)  # Notified when a job's status changes
+        self.events = []                # Job numbers of every status change, in order, indexed by event ID - 1
+        self.stopping = False
+        self.uploads = set()            # Paths of files uploaded to the user's directory
+        self.tasks = {}                 # Map of LSID -> task JSON
+        self.jobs = {}                  # Map of job number -> job JSON
+        self.child_jobs = set()         # Numbers of jobs that are children of another job, not listed on their own
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self))
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/gp'
+
+        for i in range(tasks): self.add_task(i, params, choices)
+        for n in range(1, jobs + 1): self.add_job(n, children, files, running=n <= running)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-genepattern', daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()  # End any open event streams
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Clear the request log"""
+        with self.lock: self.requests.clear()
+
+    def count(self, pattern=''):
+        """Return the number of requests received whose path contains the pattern"""
+        with self.lock: return sum(1 for _, path in self.requests if pattern in path)
+
+    def add_task(self, i, params, choices):
+        lsid = f'urn:lsid:broad.mit.edu:cancer.software.genepattern.module.analysis:{i:05d}:1'
+        self.tasks[lsid] = {
+            'lsid': lsid, 'name': f'Module{i}', 'description': f'Benchmark module {i}', 'version': '1',
+            'documentation': f'/gp/getTaskDoc.jsp?name={lsid}', 'categories': ['Benchmark'], 'tags': [],
+            'params': [self.param(j, choices) for j in range(params)],
+            'eulaInfo': {'pendingEulas': []},
+        }
+
+    @staticmethod
+    def param(j, choices):
+        attributes = {'name': f'param.{j}', 'type': 'java.lang.String', 'default_value': f'value{j}',
+                      'optional': 'on' if j % 2 else '', 'prefix_when_specified': '', 'TYPE': 'TEXT'}
+        param = {'attributes': attributes, 'description': f'Parameter {j}'}
+        if choices and j == 0:
+            param['choiceInfo'] = {'status': {'message': 'OK', 'flag': 'OK'}, 'selectedValue': 'choice0', 'choiceAllowCustom': 'false',
+                                   'choices': [{'label': f'Choice {c}', 'value': f'choice{c}'} for c in range(choices)]}
+            attributes['default_value'] = 'choice0'
+        return {f'param.{j}': param}
+
+    def add_job(self, n, children=0, files=3, running=False):
+        task = next(iter(self.tasks.values()))
+        self.jobs[n] = {
+            'jobId': str(n), 'taskName': task['name'], 'taskLsid': task['lsid'], 'userId': 'test',
+            'dateSubmitted': '2023-11-01T10:00:00Z', 'numOutputFiles': files, 'logFiles': [],
+            'status': {}, 'permissions': {'isPublic': False},
+            'outputFiles': [{'link': {'href': f'{self.url}/jobResults/{n}/output{f}.txt', 'name': f'output{f}.txt'},
+                             'fileLength': self.file_size, 'kind': 'txt'} for f in range(files)],
+            'inputParams': [{name: task_param[name]['attributes']['default_value']}
+                            for task_param in task['params'] for name in task_param],
+        }
+        self.set_running(n, running)
+        if children:
+            numbers = [1000000 + n * 1000 + c for c in range(1, children + 1)]
+            for c in numbers: self.add_job(c, files=files, running=running)
+            self.child_jobs.update(numbers)
+            self.jobs[n]['children'] = {'items': [self.jobs[c] for c in numbers]}
+
+    def set_running(self, n, running):
+        """Mark the job as running or completed"""
+        with self.changed:
+            if running: self.running.add(n)
+            else: self.running.discard(n)
+            self.jobs[n]['status'] = {'isFinished': not running, 'completedInGp': not running, 'hasError': False,
+                                      'isPending': False, 'statusMessage': 'Running' if running else 'Completed'}
+            if not running: self.jobs[n]['dateCompleted'] = '2023-11-01T10:05:00Z'
+            self.events.append(n)
+            self.changed.notify_all()
+
+    def submit(self):
+        """Create a new running job, as if submitted"""
+        with self.lock:
+            n = max(self.jobs) + 1
+            self.add_job(n, running=True)
+        return n
+
+
+def make_handler(server):
+    """Return the request handler class for the fake server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args): pass
+
+        def handle_request(self):
+            with server.lock: server.requests.append((self.command, self.path))
+            if server.latency: time.sleep(server.latency)
+            self.read_body()
+            url = urlparse(self.path)
+            path, query = unquote(url.path), parse_qs(url.query)
+            for pattern, method, route in ROUTES:
+                match = re.match(pattern, path)
+                if match and method in (self.command, None): return route(self, match, query)
+            self.send_json({'error': 'Not found'}, 404)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length: self.rfile.read(length)
+            elif self.headers.get('Transfer-Encoding') == 'chunked':
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    self.rfile.read(size + 2)
+                    if size == 0: break
+
+        def send_body(self, body, code=200, content_type='application/json', headers={}):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in headers.items(): self.send_header(key, value)
+            self.end_headers()
+            if self.command != 'HEAD': self.wfile.write(body)
+
+        def send_json(self, obj, code=200, headers={}):
+            self.send_body(json.dumps(obj).encode('utf-8'), code, headers=headers)
+
+        def token(self, match, query):
+            self.send_json({'access_token': 'benchmark-token', 'expires_in': 3600, 'refresh_token': 'benchmark-refresh'})
+
+        def system_message(self, match, query):
+            self.send_body(b'<p>Benchmark server</p>', content_type='text/html')
+
+        def task_list(self, match, query):
+            self.send_json({'all_modules': [{k: v for k, v in t.items() if k != 'params'} for t in server.tasks.values()]})
+
+        def task(self, match, query):
+            task = server.tasks.get(match.group(1)) or next((t for t in server.tasks.values() if t['name'] == match.group(1)), None)
+            if task is None: return self.send_json({'error': 'Not found'}, 404)
+            if self.headers.get('If-None-Match') == '"1"': return self.send_body(b'', 304)
+            self.send_json(task, headers={'ETag': '"1"'})
+
+        def job_list(self, match, query):
+            jobs = sorted((j for n, j in server.jobs.items() if n not in server.child_jobs), key=lambda j: -int(j['jobId']))
+            self.send_json({'items': jobs[:int(query.get('pageSize', ['10'])[0])]})
+
+        def submit(self, match, query):
+            self.send_json({'jobId': str(server.submit())}, 201)
+
+        def job_events(self, match, query):
+            if not server.push: return self.send_json({'error': 'Invalid job number: events'}, server.unsupported_status)
+            with server.lock: error = server.push_errors.pop(0) if server.push_errors else None
+            if error: return self.send_json({'error': 'Server error'}, error)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Transfer-Encoding', 'chunked')  # Sent as each event occurs
+            self.end_headers()
+            self.close_connection = True
+
+            last = self.headers.get('Last-Event-ID')
+            with server.lock: sent = int(last) if last and last.isdigit() else len(server.events)
+            try:
+                while True:
+                    with server.changed:
+                        server.changed.wait_for(lambda: len(server.events) > sent or server.stopping, timeout=15)
+                        if server.stopping: break
+                        events = [(i + 1, server.jobs[n]) for i, n in enumerate(server.events[sent:], sent)]
+                        body = ''.join(f'id: {i}\nevent: status\ndata: {json.dumps(job)}\n\n' for i, job in events)
+                    self.write_chunk(body.encode('utf-8') if body else b': keep-alive\n\n')
+                    sent += len(events)
+                self.write_chunk(b'')  # End of the stream
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client disconnected
+
+        def write_chunk(self, data):
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def job(self, match, query):
+            job = server.jobs.get(int(match.group(1)))
+            if job is None: self.send_json({'error': 'Not found'}, 404)
+            else: self.send_json(job)
+
+        def permissions(self, match, query):
+            self.send_json({'groups': [{'id': '*', 'read': False, 'write': False}]})
+
+        def job_file(self, match, query):
+            if int(match.group(1)) not in server.jobs: return self.send_json({'error': 'Not found'}, 404)
+            self.send_body(b'x' * server.file_size, content_type='text/plain')
+
+        def upload(self, match, query):
+            location = f'{server.url}/users/test/tmp/{query["name"][0]}'
+            with server.lock: server.uploads.add(f'tmp/{query["name"][0]}')
+            self.send_body(b'', 201, headers={'Location': location})
+
+        def multipart_start(self, match, query):
+            self.send_json({'token': 'benchmark-upload'})
+
+        def multipart_part(self, match, query):
+            self.send_json({})
+
+        def multipart_assemble(self, match, query):
+            with server.lock: server.uploads.add(query['path'][0])
+            self.send_json({})
+
+        def user_file(self, match, query):
+            if match.group(1) in server.uploads: self.send_body(b'', content_type='text/plain')
+            else: self.send_json({'error': 'Not found'}, 404)
+
+        def redirect(self, match, query):
+            self.send_body(b'', 302, headers={'Location': f'https://storage.example.org/{match.group(1)}'})
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = handle_request
+
+    ROUTES = [  # List of (path pattern, HTTP method or None for any, handler)
+        (r'/gp/rest/v1/oauth2/token$', 'POST', Handler.token),
+        (r'/gp/rest/v1/config/system-message$', 'GET', Handler.system_message),
+        (r'/gp/rest/v1/tasks/all.json$', 'GET', Handler.task_list),
+        (r'/gp/rest/v1/tasks/(.+?)/?$', 'GET', Handler.task),
+        (r'/gp/rest/v1/jobs/?$', 'GET', Handler.job_list),
+        (r'/gp/rest/v1/jobs/?$', 'POST', Handler.submit),
+        (r'/gp/rest/v1/jobs/events$', 'GET', Handler.job_events),
+        (r'/gp/rest/v1/jobs/(\d+)/permissions$', None, Handler.permissions),
+        (r'/gp/rest/v1/jobs/(\d+)$', 'GET', Handler.job),
+        (r'/gp/jobResults/(\d+)/(.+)$', None, Handler.job_file),
+        (r'/gp/rest/v1/data/upload/job_input$', 'POST', Handler.upload),
+        (r'/gp/rest/v1/upload/multipart/assemble/$', 'POST', Handler.multipart_assemble),
+        (r'/gp/rest/v1/upload/multipart/$', 'POST', Handler.multipart_start),
+        (r'/gp/rest/v1/upload/multipart/$', 'PUT', Handler.multipart_part),
+        (r'/gp/users/test/(.+)$', None, Handler.user_file),
+        (r'/gp/redirect/(.+)$', None, Handler.redirect),
+    ]
+    return Handler
@@ -1,12 +1,70 @@
-from .authwidget import GENEPATTERN_SERVERS, GPAuthWidget
-from .taskwidget import GPTaskWidget, reproduce_job, load_task
-from .jobwidget import GPJobWidget
-from .sessions import session, get_session, register_session
-from .display import display
-from nbtools import UIBuilder as GPUIBuilder, UIOutput as GPUIOutput, build_ui, open
+import importlib
+import sys
+import types
 
 __author__ = 'Thorin Tabor'
 __copyright__ = 'Copyright 2014-2023, Regents of the University of California & Broad Institute'
 __version__ = '23.11'
 __status__ = 'Production'
 __license__ = 'BSD-3-Clause'
+
+
+"""
+Public names, mapped to the modules that define them. These are imported the first time they are accessed,
+so that importing the package when nbtools loads it at kernel start is fast.
+"""
+_exports = {
+    'GENEPATTERN_SERVERS': ('.utils', 'GENEPATTERN_SERVERS'),
+    'GPAuthWidget': ('.authwidget', 'GPAuthWidget'),
+    'GPTaskWidget': ('.taskwidget', 'GPTaskWidget'),
+    'reproduce_job': ('.taskwidget', 'reproduce_job'),
+    'reproduce_jobs': ('.taskwidget', 'reproduce_jobs'),
+    'load_task': ('.taskwidget', 'load_task'),
+    'GPJobWidget': ('.jobwidget', 'GPJobWidget'),
+    'GPJobTable': ('.jobtable', 'GPJobTable'),
+    'session': ('.sessions', 'session'),
+    'get_session': ('.sessions', 'get_session'),
+    'register_session': ('.sessions', 'register_session'),
+    'display': ('.display', 'display'),
+    'GPUIBuilder': ('nbtools', 'UIBuilder'),
+    'GPUIOutput': ('nbtools', 'UIOutput'),
+    'build_ui': ('nbtools', 'build_ui'),
+    'open': ('nbtools', 'open'),
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    """Import public names and submodules the first time they are accessed"""
+    if name in _exports:
+        module, attr = _exports[name]
+        value = getattr(importlib.import_module(module, __name__), attr)
+        globals()[name] = value  # Cache the value, so that this is only called once per name
+        return value
+    try: return importlib.import_module(f'.{name}', __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{name}': raise e
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'") from None
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+class _Package(types.ModuleType):
+    """Type of the package module. Importing a submodule binds it as an attribute of the package, so when the
+       display submodule is imported, the display() function is bound in its place."""
+
+    def __setattr__(self, name, value):
+        if name == 'display' and isinstance(value, types.ModuleType): value = value.display
+        types.ModuleType.__setattr__(self, name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+
+# Register the authentication widget, if nbtools is loaded. Otherwise it is registered when a widget is first used.
+if 'nbtools' in sys.modules:
+    from .tools import register_tools
+    register_tools()
@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from . import shim
+
+
+logger = logging.getLogger(__name__)
+
+"""
+Shared executor used to run GenePattern REST calls off the kernel thread
+"""
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='genepattern')
+
+
+async def run(func, *args, **kwargs):
+    """Run the blocking call in the shared executor and await the result, in the caller's context"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # Requests are attributed to the widget that scheduled them
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+def submit(func, *args, **kwargs):
+    """Run the blocking call in the shared executor from synchronous code, in the caller's context, returning a Future"""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, func, *args, **kwargs)
+
+
+def schedule(coro, callback=None, error_callback=None):
+    """
+    Run the coroutine on the running event loop, calling the callback with the result once it completes.
+    Errors are passed to the error callback, or logged if none is given, as the cell that scheduled the
+    coroutine may no longer be the one whose output is active. If no event loop is running in this thread,
+    the coroutine is run to completion before returning.
+    :param coro:
+    :param callback:
+    :param error_callback:
+    :return: the scheduled asyncio.Task, or the result if run synchronously
+    """
+    try: loop = asyncio.get_running_loop()
+    except RuntimeError: loop = None
+
+    # Run synchronously if there is no running event loop, for example in a polling thread
+    if loop is None:
+        try: result = asyncio.run(coro)
+        except Exception as e:
+            if error_callback: return error_callback(e)
+            else: raise e
+        if callback: callback(result)
+        return result
+
+    # Otherwise, schedule the coroutine on the Jupyter event loop
+    def done(task):
+        if task.cancelled(): return
+        if task.exception() is not None:
+            if error_callback: error_callback(task.exception())
+            else: logger.error('Error contacting GenePattern server', exc_info=task.exception())
+        elif callback: callback(task.result())
+    task = loop.create_task(coro)
+    task.add_done_callback(done)
+    return task
+
+
+async def system_message(session):
+    return await run(shim.system_message, session)
+
+
+async def get_task(session, lsid_or_name):
+    return await run(shim.get_task, session, lsid_or_name)
+
+
+async def param_load(task):
+    """Query the server for the task's parameters and metadata, returning the loaded task"""
+    return await run(shim.param_load, task)
+
+
+async def get_info(job):
+    """Query the server for the job's info, returning the loaded job"""
+    return await run(shim.get_info, job)
+
+
+async def get_permissions(job):
+    return await run(shim.get_permissions, job)
+
+
+async def set_permissions(job, permissions):
+    return await run(shim.set_permissions, job, permissions)
+
+
+async def terminate_job(job):
+    return await run(shim.terminate_job, job)
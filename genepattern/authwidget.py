@@ -1,11 +1,14 @@
 import gp
 from IPython.display import display
 from urllib.error import HTTPError
-from nbtools import UIBuilder, ToolManager, NBTool, EventManager, DataManager, Data
+from nbtools import UIBuilder, ToolManager, EventManager, DataManager, Data
+from .instrumentation import traced
 from .sessions import session
-from .shim import login, system_message
+from .shim import get_token, get_task_list, get_recent_jobs
+from . import aio
 from .jobwidget import GPJobWidget
 from .taskwidget import TaskTool
+from .tools import AuthenticationTool, register_tools
 from .utils import GENEPATTERN_LOGO, GENEPATTERN_SERVERS, server_name, session_color
 
 
@@ -46,6 +49,7 @@ AUTO_LOGIN_CHECK = """
 
 class GPAuthWidget(UIBuilder):
     """A widget for authenticating with a GenePattern server"""
+    registered_jobs = {}  # Map of origins -> map of job numbers -> registered output file URIs
     login_spec = {  # The display values for building the login UI
         'name': 'Login',
         'collapse': False,
@@ -107,6 +111,7 @@ class GPAuthWidget(UIBuilder):
             # Call the superclass constructor with the spec
             UIBuilder.__init__(self, self.login, **kwargs)
 
+    @traced('GPAuthWidget')
     def prepare_session(self):
         """Prepare a valid session by registering the session and modules"""
         self.register_session()     # Register the session with the SessionList
@@ -135,12 +140,11 @@ class GPAuthWidget(UIBuilder):
         if not self.session.password: return False              # Test password
         return True
 
+    @traced('GPAuthWidget')
     def validate_credentials(self):
-        """Call gpserver.login() to validate the provided credentials"""
+        """Validate the provided credentials, reusing a cached token if one was already issued for them"""
         try:
-            # Check to see if gp library supports login, otherwise call login shim
-            if hasattr(self.session, 'login'): self.token = self.session.login()
-            else: self.token = login(self.session)
+            self.token = get_token(self.session)
             gp.core.GP_JOB_TAG = 'GenePattern Notebook'  # Set tag for jobs
             return True
         except HTTPError:
@@ -166,43 +170,51 @@ class GPAuthWidget(UIBuilder):
 
     def register_modules(self):
         """Get the list available modules and register widgets for them with the tool manager"""
-        for task in self.session.get_task_list():
-            tool = TaskTool(server_name(self.session.url), task)
-            ToolManager.instance().register(tool)
+        origin = server_name(self.session.url)
+        tools = [TaskTool(origin, task) for task in get_task_list(self.session)]  # Task metadata is loaded lazily
+        ToolManager.instance().register_all(tools)  # Register in bulk, sending a single update to the client
 
     def system_message(self):
-        if hasattr(self.session, 'system_message'): message = self.session.system_message()
-        else: message = system_message(self.session)
-        self.info = message
+        """Query the system message without blocking the kernel and display it once received"""
+        def display_message(message): self.info = message
+        aio.schedule(aio.system_message(self.session), display_message)
 
     def trigger_login(self):
         """Dispatch a login event after authentication"""
         EventManager.instance().dispatch("gp.login", self.session)
 
     def register_jobs(self):
+        """Add the user's recent jobs to the data panel from one bulk query, registering only what is new"""
+        origin = server_name(self.session.url)
+        registered = GPAuthWidget.registered_jobs.setdefault(origin, {})
         data_list = []
-        for job in self.session.get_recent_jobs():
-            origin = server_name(self.session.url)
+        for job in get_recent_jobs(self.session):
             group = f"{job.job_number}. {job.task_name}"
+            uris = [f['link']['href'] for f in job.output_files]
 
-            # Register a custom data group widget (GPJobWidget) with the manager
-            DataManager.instance().group_widget(origin=origin, group=group, widget=GPJobWidget(job))
+            # Register a custom data group widget (GPJobWidget) with the manager, created when the group is opened
+            if job.job_number not in registered:
+                DataManager.instance().group_widget(origin=origin, group=group, widget=lazy_job_widget(job))
+                registered[job.job_number] = set()
 
-            # Add data entries for all output files
-            for file in job.get_output_files():
-                data_list.append(Data(origin=origin, group=group, uri=file.get_url()))
-        DataManager.instance().register_all(data_list)
+            # Add data entries for any output files not already registered
+            for uri in uris:
+                if uri not in registered[job.job_number]:
+                    data_list.append(Data(origin=origin, group=group, uri=uri))
+                    registered[job.job_number].add(uri)
+        if data_list: DataManager.instance().register_all(data_list)
 
 
-class AuthenticationTool(NBTool):
-    """Tool wrapper for the authentication widget"""
-    origin = '+'
-    id = 'authentication'
-    name = 'GenePattern Login'
-    description = 'Log into a GenePattern server'
-    load = lambda x: GPAuthWidget()
+def lazy_job_widget(job):
+    """Return a function that creates the GPJobWidget for the job the first time it is called"""
+    widget = None
+    def load():
+        nonlocal widget
+        if widget is None: widget = GPJobWidget(job)
+        return widget
+    return load
 
 
-# Register the authentication widget
-ToolManager.instance().register(AuthenticationTool())
+# Register the authentication widget, if not already registered when the package was imported
+register_tools()
 
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def cache_dir(name):
+    """Return the path of the named local cache directory, honoring GENEPATTERN_CACHE_DIR and XDG_CACHE_HOME"""
+    base = os.environ.get('GENEPATTERN_CACHE_DIR') or \
+        os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'genepattern')
+    return os.path.join(base, name)
+
+
+def is_versioned_lsid(lsid_or_name):
+    """Is this a full LSID, including the version? Metadata for a versioned LSID never changes."""
+    parts = lsid_or_name.split(':') if lsid_or_name else []
+    return len(parts) == 6 and parts[0].lower() == 'urn' and parts[1].lower() == 'lsid' and parts[5] != ''
+
+
+class TaskCache:
+    """
+    Persistent local cache of task metadata, keyed by server, user and LSID or module name.
+    Entries are stored as JSON files and evicted least recently used first once the cache
+    exceeds its size bounds.
+    """
+    enabled = True
+    max_entries = 1000              # Maximum number of cached tasks
+    max_bytes = 50 * 1024 * 1024    # Maximum total size of the cache on disk
+
+    def __init__(self, path=None):
+        self.path = path if path else cache_dir('tasks')
+        self.lock = threading.Lock()
+
+    def _file(self, session, lsid_or_name):
+        key = f'{session.url.rstrip("/")}|{session.username}|{lsid_or_name}'
+        return os.path.join(self.path, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, session, lsid_or_name):
+        """Return the cached entry dict (json, etag, last_modified), or None if not cached"""
+        if not self.enabled: return None
+        file = self._file(session, lsid_or_name)
+        try:
+            with open(file, 'r') as f: entry = json.load(f)
+            os.utime(file)  # Mark as recently used
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def put(self, session, lsid_or_name, json_str, etag=None, last_modified=None):
+        """Add the task JSON to the cache, evicting old entries if needed"""
+        if not self.enabled: return
+        file = self._file(session, lsid_or_name)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            temp_file = f'{file}.{threading.get_ident()}.tmp'
+            with open(temp_file, 'w') as f:
+                json.dump({'json': json_str, 'etag': etag, 'last_modified': last_modified}, f)
+            os.replace(temp_file, file)  # Atomic, so concurrent readers never see a partial entry
+            self.evict()
+        except OSError:
+            pass  # The cache is an optimization, never fail because of it
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is within its size bounds"""
+        with self.lock:
+            try:
+                entries = [e for e in os.scandir(self.path) if e.name.endswith('.json')]
+                stats = sorted([(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries])
+                total = sum(s[1] for s in stats)
+                while stats and (len(stats) > self.max_entries or total > self.max_bytes):
+                    _, size, path = stats.pop(0)
+                    os.remove(path)
+                    total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            try:
+                for e in os.scandir(self.path):
+                    if e.name.endswith('.json'): os.remove(e.path)
+            except OSError:
+                pass
+
+
+"""
+GenePattern task metadata cache singleton
+"""
+task_cache = TaskCache()
@@ -0,0 +1,190 @@
+import io
+import os
+import tempfile
+import weakref
+import numpy as np
+import pandas as pd
+from gp import GPFile
+from .cache import cache_dir
+from .filecache import file_cache
+from .sessions import session as sessions
+from .shim import rest_request
+from .utils import is_url
+
+
+CHUNK_ROWS = 2000       # Rows parsed at a time when streaming a file
+MEMMAP_MAX_BYTES = 10 * 1024 * 1024 * 1024  # Maximum total size of memmap spill files on disk
+
+ODF_TYPES = {'string': object, 'int': 'int64', 'integer': 'int64', 'long': 'int64', 'float': 'float64', 'double': 'float64',
+             'boolean': 'bool'}
+
+
+def read_gct(source, columns=None, rows=None, dtype='float64', memmap=False, chunk_rows=CHUNK_ROWS):
+    """
+    Load a GCT file into a DataFrame indexed by Name and Description, with one column per sample.
+    The file is parsed in chunks as it streams from the server, so it is never held in memory as text.
+    :param source: GPFile, URL, local path or binary file-like object
+    :param columns: optional list of sample names to load, all others are skipped while parsing
+    :param rows: optional list of row names to load
+    :param dtype: dtype of the expression values, for example 'float32' to halve memory use
+    :param memmap: spill the values to a memory-mapped file in the local cache rather than holding them in memory,
+                   the file is removed once the values are no longer referenced
+    :param chunk_rows: number of rows to parse at a time
+    :return: DataFrame
+    """
+    with open_stream(source) as stream:
+        version = stream.readline().decode('utf-8').strip()
+        dimensions = stream.readline().decode('utf-8').split('\t')
+        if version != '#1.2': raise TypeError(f'Unsupported GCT version: {version}')
+        header = stream.readline().decode('utf-8').rstrip('\r\n').split('\t')
+        samples = [c for c in header[2:] if columns is None or c in columns]
+        total_rows = int(dimensions[0])
+
+        # Allocate the matrix up front, a file-backed memmap if spilling to disk
+        if memmap:
+            shape = (max(total_rows, 1), len(samples))
+            path = memmap_file(shape[0] * shape[1] * np.dtype(dtype).itemsize)
+            values = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            weakref.finalize(values, remove_file, path)  # Views, including the DataFrame's, keep the memmap alive
+        else: values = np.empty((total_rows, len(samples)), dtype=dtype)
+
+        # Parse the data lines in chunks, copying each into the matrix
+        names, descriptions, count = [], [], 0
+        reader = pd.read_csv(stream, sep='\t', header=None, names=header, usecols=header[:2] + samples,
+                             dtype={**{c: dtype for c in samples}, header[0]: str, header[1]: str},
+                             chunksize=chunk_rows)
+        for chunk in reader:
+            if rows is not None: chunk = chunk[chunk[header[0]].isin(rows)]
+            if count + len(chunk) > len(values): raise TypeError('Error parsing GCT file, more rows than declared')
+            values[count:count + len(chunk)] = chunk[samples].to_numpy(dtype=dtype)
+            names.extend(chunk[header[0]])
+            descriptions.extend(chunk[header[1]])
+            count += len(chunk)
+
+    if memmap: values.flush()
+    index = pd.MultiIndex.from_arrays([names, descriptions], names=header[:2])
+    return pd.DataFrame(values[:count], index=index, columns=samples, copy=False)
+
+
+def read_odf(source, columns=None, rows=None, dtype=None, chunk_rows=CHUNK_ROWS):
+    """
+    Load an ODF file into a DataFrame, with the ODF headers and model available as DataFrame.headers and
+    DataFrame.model, as with gp.data.ODF. The file is parsed in chunks as it streams from the server, so it
+    is never held in memory as text. Columns are given the types declared in COLUMN_TYPES where their
+    values allow, otherwise the inferred type is kept, for example float for an int column with blanks.
+    :param source: GPFile, URL, local path or binary file-like object
+    :param columns: optional list of column names to load, all others are skipped while parsing
+    :param rows: optional list of row positions to load
+    :param dtype: optional dtype to downcast numeric columns of the same kind to, for example 'float32'
+    :param chunk_rows: number of rows to parse at a time
+    :return: DataFrame
+    """
+    with open_stream(source) as stream:
+        try:
+            # Read the header lines, as specified by the HeaderLines header
+            if not stream.readline().decode('utf-8').startswith('ODF'): raise ValueError('Missing ODF version')
+            header_count = int(stream.readline().decode('utf-8').split('=')[1])
+            headers = {}
+            for _ in range(header_count):
+                line = stream.readline().decode('utf-8').rstrip('\r\n')
+                separator = ':' if line.startswith('COLUMN_') else '='
+                key, _, value = line.partition(separator)
+                headers[key] = value
+
+            # Determine the column names and types
+            names = headers['COLUMN_NAMES'].split('\t')
+            types = headers['COLUMN_TYPES'].split('\t') if 'COLUMN_TYPES' in headers else ['String'] * len(names)
+            usecols = [n for n in names if columns is None or n in columns]
+            dtypes = {}
+            for name, column_type in zip(names, types):
+                column_type = ODF_TYPES.get(column_type.lower(), object)
+                if dtype is not None and column_type != object and np.dtype(column_type).kind == np.dtype(dtype).kind:
+                    column_type = dtype  # Only downcast columns of the same kind, for example float64 to float32
+                dtypes[name] = column_type
+
+            # Parse the data lines in chunks, only string columns are typed while parsing
+            chunks, start = [], 0
+            reader = pd.read_csv(stream, sep='\t', header=None, names=names, usecols=usecols,
+                                 dtype={n: object for n in usecols if dtypes[n] == object}, skip_blank_lines=True,
+                                 chunksize=chunk_rows)
+            for chunk in reader:
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+                if rows is not None: chunk = chunk[chunk.index.isin(rows)]
+                chunks.append(chunk)
+        except (ValueError, KeyError, IndexError):
+            raise TypeError('Error parsing ODF file')
+
+    df = pd.concat(chunks) if chunks else pd.DataFrame(columns=usecols)  # Columns are already in file order
+    for name in usecols: df[name] = coerce_column(df[name], dtypes[name])
+
+    # Attach the ODF metadata as gp.data.ODF does, bypassing pandas' warning about setting attributes
+    object.__setattr__(df, 'headers', headers)
+    object.__setattr__(df, 'model', headers.get('Model'))
+    df.attrs['headers'] = headers
+    df.attrs['model'] = headers.get('Model')
+    return df
+
+
+def coerce_column(column, dtype):
+    """Return the column converted to the declared dtype, or unchanged if its values can't be represented exactly"""
+    if dtype == object or column.dtype == dtype: return column
+    kind = np.dtype(dtype).kind
+    if kind == 'f' and column.dtype.kind in 'if': return column.astype(dtype)
+    if kind == 'i' and column.dtype.kind == 'i': return column.astype(dtype)
+    if kind == 'i' and column.dtype.kind == 'f' and column.notna().all() and (column % 1 == 0).all(): return column.astype(dtype)
+    return column  # For example blanks in an int column, which stays float with NaN
+
+
+def open_stream(source):
+    """Return a binary, buffered stream of the file's contents, from the file cache or streamed from the server"""
+    if isinstance(source, GPFile): return open_url(source.uri, source.server_data)
+    if isinstance(source, str) and '\n' in source: return io.BytesIO(source.encode('utf-8'))  # Raw file contents
+    if isinstance(source, str) and is_url(source): return open_url(source, sessions.find(source))
+    if isinstance(source, str): return open(source, 'rb')
+    if isinstance(source, io.TextIOBase): return io.BytesIO(source.read().encode('utf-8'))
+    return source if isinstance(source, io.BufferedIOBase) else io.BufferedReader(source)
+
+
+def open_url(url, session=None):
+    """Stream the file at the URL, authenticating if it is on a registered GenePattern server"""
+    if file_cache.cacheable(session, url): return file_cache.open(session, url)
+    if session is not None: response = rest_request(session, 'GET', url, stream=True)
+    else:
+        response = sessions.http(url).get(url, stream=True, timeout=sessions.timeout)
+        response.raise_for_status()
+    response.raw.decode_content = True  # Decompress gzipped responses while streaming
+    response.raw.auto_close = False     # Let the buffered reader see the end of the stream before it closes
+    return io.BufferedReader(response.raw, buffer_size=1024 * 1024)
+
+
+def memmap_file(size):
+    """Return the path of a new, uniquely named memmap file in the local cache, first removing the oldest
+       spill files if adding one of the given size would exceed the cache's size cap"""
+    directory = cache_dir('dataframes')
+    os.makedirs(directory, exist_ok=True)
+    evict_memmaps(directory, MEMMAP_MAX_BYTES - size)
+    handle, path = tempfile.mkstemp(suffix='.npy', dir=directory)
+    os.close(handle)
+    return path
+
+
+def evict_memmaps(directory, max_bytes):
+    """Remove the least recently modified spill files until their total size is within max_bytes. Files left
+       by earlier kernels are removed this way. Removed files that are still mapped stay readable on POSIX
+       systems, and files that can't be removed are skipped."""
+    try: files = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(directory) if e.name.endswith('.npy'))
+    except OSError: return
+    total = sum(f[1] for f in files)
+    for _, size, path in files:
+        if total <= max_bytes: break
+        if remove_file(path): total -= size
+
+
+def remove_file(path):
+    """Remove the file if it exists, returning whether it was removed"""
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
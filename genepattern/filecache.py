@@ -0,0 +1,195 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from urllib.parse import urlparse
+from gp import GPFile, GPJob
+from .cache import cache_dir
+from .polling import job_poller, is_terminal
+from .shim import get_info
+from .transfer import download_file, file_digest
+
+
+class FileCache:
+    """
+    Persistent local cache of job output files, which are immutable once a job completes. Entries are keyed
+    by server, job and file path, and point to files stored by their content hash, so identical outputs are
+    only stored once. Files are evicted least recently used first once the cache exceeds its size cap.
+    """
+    enabled = True
+    max_bytes = 2 * 1024 * 1024 * 1024     # Maximum total size of the cached files on disk
+    recheck = 10                            # Seconds before the status of an unfinished job is queried again
+
+    def __init__(self, path=None):
+        self.path = path if path else cache_dir('files')
+        self.lock = threading.Lock()
+        self.finished = set()   # Set of (server, job number) of jobs known to have finished
+        self.unfinished = {}    # Map of (server, job number) -> time an untracked job was last found unfinished
+
+    @staticmethod
+    def job_number(url):
+        """Return the job number of a job output file URL, or None if the URL isn't a job output"""
+        parts = urlparse(url).path.split('/')
+        if 'jobResults' not in parts: return None
+        index = parts.index('jobResults')
+        return int(parts[index + 1]) if len(parts) > index + 2 and parts[index + 1].isdigit() else None
+
+    def cacheable(self, session, url):
+        """Can the file be cached? Only outputs of jobs that have finished are immutable. The job's status is
+           taken from the info loaded by the session's poller if the job is being polled, otherwise it is
+           queried from the server, at most once every recheck seconds while the job hasn't finished."""
+        if not self.enabled or session is None: return False
+        job_number = self.job_number(url)
+        if job_number is None: return False
+        key = (session.url.rstrip('/'), job_number)
+        with self.lock:
+            if key in self.finished: return True
+        if self.lookup(session, url) is not None: return True  # Files are only cached once their job has finished
+
+        poller = job_poller(session)
+        with poller.lock: job = poller.jobs.get(job_number)
+        if job is not None and job.info: info = job.info
+        else:
+            with self.lock:
+                if key in self.unfinished and time.monotonic() - self.unfinished[key] < self.recheck: return False
+            try: info = get_info(GPJob(session, job_number)).info
+            except Exception: return False  # Status unknown, so don't cache
+        with self.lock:
+            if not is_terminal(info):
+                self.unfinished[key] = time.monotonic()
+                return False
+            self.unfinished.pop(key, None)
+            self.finished.add(key)
+        return True
+
+    def _entry_file(self, session, url):
+        key = f'{session.url.rstrip("/")}|{self.job_number(url)}|{urlparse(url).path}'
+        return os.path.join(self.path, 'entries', hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _blob_file(self, digest):
+        return os.path.join(self.path, 'blobs', digest)
+
+    def lookup(self, session, url):
+        """Return the local path of the cached file, or None if not cached"""
+        try:
+            with open(self._entry_file(session, url), 'r') as f: digest = json.load(f)['sha256']
+            blob = self._blob_file(digest)
+            os.utime(blob)  # Mark as recently used, raises if the file was evicted
+            return blob
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def fetch(self, session, url, expected_size=None, progress=None):
+        """Return the local path of the cached file, downloading it into the cache if needed"""
+        blob = self.lookup(session, url)
+        if blob is not None: return blob
+
+        # Download to a partial file, then store it by the hash of its content
+        os.makedirs(os.path.join(self.path, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'entries'), exist_ok=True)
+        download = os.path.join(self.path, 'blobs', f'{hashlib.sha256(url.encode("utf-8")).hexdigest()}.{threading.get_ident()}.download')
+        download_file(session, url, download, expected_size=expected_size, progress=progress)
+        digest = file_digest(download, 'sha256')
+        blob = self._blob_file(digest)
+        os.replace(download, blob)
+
+        entry = self._entry_file(session, url)
+        with open(f'{entry}.{threading.get_ident()}.tmp', 'w') as f: json.dump({'url': url, 'sha256': digest}, f)
+        os.replace(f'{entry}.{threading.get_ident()}.tmp', entry)
+        self.evict()
+        return blob
+
+    def open(self, session, url):
+        """Return a read-only, memory-mapped binary file handle for the file, downloading it if not cached"""
+        return io.BufferedReader(MappedFile(self.fetch(session, url)))
+
+    def copy(self, session, url, path, expected_size=None, progress=None):
+        """Copy the file to the local path, downloading it into the cache if needed"""
+        blob = self.fetch(session, url, expected_size=expected_size, progress=progress)
+        if os.path.exists(path): os.remove(path)
+        if not reflink(blob, path): shutil.copyfile(blob, path)
+        return path
+
+    def evict(self):
+        """Remove the least recently used files until the cache is within its size cap"""
+        with self.lock:
+            try:
+                blobs = [e for e in os.scandir(os.path.join(self.path, 'blobs')) if '.download' not in e.name]
+                stats = sorted([(e.stat().st_mtime, e.stat().st_size, e.path) for e in blobs])
+                total = sum(s[1] for s in stats)
+                while stats and total > self.max_bytes:
+                    _, size, path = stats.pop(0)
+                    os.remove(path)  # Entries pointing to the file become misses
+                    total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all files from the cache"""
+        with self.lock: shutil.rmtree(self.path, ignore_errors=True)
+
+
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents, on file systems such as Btrfs and XFS
+
+
+def reflink(source, path):
+    """Copy the file as a copy-on-write clone, which shares no data with the source once either is written.
+       Return False if the platform or file system doesn't support clones, without creating the file."""
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(path, 'wb') as dst: fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (ImportError, OSError):
+        if os.path.exists(path): os.remove(path)
+        return False
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only file handle that serves a local file through a memory map"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        self.position = 0
+
+    def readable(self): return True
+
+    def seekable(self): return True
+
+    def readinto(self, buffer):
+        if self.map is None: return 0
+        data = self.map[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        size = len(self.map) if self.map is not None else 0
+        self.position = max({io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: size}[whence] + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self.map is not None: self.map.close()
+        self.file.close()
+        super().close()
+
+
+class CachedGPFile(GPFile):
+    """A GPFile that serves its contents from the local file cache, downloading them only once"""
+
+    def open(self):
+        if not file_cache.cacheable(self.server_data, self.uri): return GPFile.open(self)
+        return file_cache.open(self.server_data, self.uri)
+
+
+"""
+GenePattern job output file cache singleton
+"""
+file_cache = FileCache()
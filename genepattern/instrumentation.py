@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import os
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+
+"""
+Name of the widget or event on whose behalf requests are currently being made
+"""
+caller = contextvars.ContextVar('genepattern_caller', default=None)
+
+
+def traced(name):
+    """Decorator attributing all requests made during the call to the named widget or event"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled: return func(*args, **kwargs)
+            token = caller.set(name)
+            try: return func(*args, **kwargs)
+            finally: caller.reset(token)
+        return wrapper
+    return decorator
+
+
+ENDPOINT_PATTERNS = [  # List of (pattern, replacement) applied in order to turn URL paths into endpoint templates
+    (re.compile(r'^.*?/gp(?=/|$)'), ''),                                    # Server prefix
+    (re.compile(r'/jobResults/\d+/.*$'), '/jobResults/{job}/{file}'),
+    (re.compile(r'/users/[^/]+/.*$'), '/users/{user}/{file}'),
+    (re.compile(r'/rest/v1/tasks/(?!all\.json)[^/]+/?$'), '/rest/v1/tasks/{task}'),
+    (re.compile(r'/\d+(?=/|$)'), '/{id}'),
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def endpoint(url):
+    """Return the endpoint template for the URL, for example /rest/v1/jobs/{id}"""
+    path = urlparse(url).path
+    for pattern, replacement in ENDPOINT_PATTERNS: path = pattern.sub(replacement, path)
+    return path or '/'
+
+
+class Histogram:
+    """Latency histogram with fixed bucket boundaries, in seconds"""
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)   # The last bucket counts everything above the largest boundary
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]: index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Estimate the quantile as the upper boundary of the bucket it falls in"""
+        target, seen = q * self.count(), 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n: return self.buckets[index] if index < len(self.buckets) else self.max
+        return None
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.total, 'max': self.max}
+
+
+class RequestMetrics:
+    """
+    Records every request made through the pooled HTTP sessions: the endpoint template, status, bytes,
+    latency and the widget or event that made it. Aggregated counters and latency histograms are
+    available in the notebook, and each request may also be passed to exporters, such as
+    OpenTelemetryExporter. When disabled, the only cost is a flag check per request.
+    """
+    enabled = os.environ.get('GENEPATTERN_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    history = 1000              # Number of recent requests kept for inspection
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exporters = []
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Clear all recorded metrics"""
+        with self.lock:
+            self.counters = {}                          # Map of (method, endpoint, status, caller) -> counter dict
+            self.histograms = {}                        # Map of (method, endpoint) -> Histogram
+            self.recent = deque(maxlen=self.history)    # Most recent request records
+
+    def hook(self, response, *args, **kwargs):
+        """Response hook registered with each pooled requests.Session"""
+        if not self.enabled: return
+        request = response.request
+        body = request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else int(request.headers.get('Content-Length') or 0)
+        received = int(response.headers.get('Content-Length') or 0)  # The body may not be read yet, so use the header
+        self.record(request.method, request.url, response.status_code, sent, received, response.elapsed.total_seconds())
+
+    def record(self, method, url, status, sent=0, received=0, latency=0.0, name=None):
+        """Record a completed request"""
+        record = {
+            'time': time.time(),
+            'method': method,
+            'endpoint': endpoint(url),
+            'url': url,
+            'status': status,
+            'sent': sent,
+            'received': received,
+            'latency': latency,
+            'caller': name if name is not None else caller.get(),
+        }
+        with self.lock:
+            key = (method, record['endpoint'], status, record['caller'])
+            counter = self.counters.setdefault(key, {'requests': 0, 'sent': 0, 'received': 0})
+            counter['requests'] += 1
+            counter['sent'] += sent
+            counter['received'] += received
+            self.histograms.setdefault((method, record['endpoint']), Histogram()).observe(latency)
+            self.recent.append(record)
+            exporters = list(self.exporters)
+        for exporter in exporters:
+            try: exporter(record)
+            except Exception: pass  # Exporting must never break a request
+
+    def add_exporter(self, exporter):
+        """Add a callable that is passed the record dict of every request"""
+        with self.lock: self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        with self.lock: self.exporters.remove(exporter)
+
+    def requests(self):
+        """Return a list of the most recent request records"""
+        with self.lock: return list(self.recent)
+
+    def summary(self):
+        """Return a list of dicts, one per method, endpoint, status and caller, with request counts and bytes"""
+        with self.lock:
+            return [{'method': k[0], 'endpoint': k[1], 'status': k[2], 'caller': k[3], **v} for k, v in self.counters.items()]
+
+    def latency(self):
+        """Return a map of (method, endpoint) -> latency histogram dict"""
+        with self.lock: return {k: v.to_dict() for k, v in self.histograms.items()}
+
+    def table(self):
+        """Return a DataFrame summarizing the requests and latency of each endpoint, slowest first"""
+        import pandas as pd
+        with self.lock:
+            rows = []
+            for (method, path), histogram in self.histograms.items():
+                counters = [v for k, v in self.counters.items() if k[:2] == (method, path)]
+                errors = sum(v['requests'] for k, v in self.counters.items() if k[:2] == (method, path) and k[2] >= 400)
+                rows.append({'method': method, 'endpoint': path, 'requests': histogram.count(), 'errors': errors,
+                             'sent': sum(c['sent'] for c in counters), 'received': sum(c['received'] for c in counters),
+                             'total_ms': histogram.total * 1000, 'mean_ms': histogram.total * 1000 / histogram.count(),
+                             'p95_ms': histogram.quantile(0.95) * 1000, 'max_ms': histogram.max * 1000})
+        columns = ['method', 'endpoint', 'requests', 'errors', 'sent', 'received', 'total_ms', 'mean_ms', 'p95_ms', 'max_ms']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_ms', ascending=False, ignore_index=True)
+
+
+class OpenTelemetryExporter:
+    """Exports each request as an OpenTelemetry span and latency histogram, requires the opentelemetry-api package"""
+
+    def __init__(self, tracer_provider=None, meter_provider=None):
+        from opentelemetry import trace, metrics as otel_metrics
+        self.tracer = trace.get_tracer('genepattern', tracer_provider=tracer_provider)
+        meter = otel_metrics.get_meter('genepattern', meter_provider=meter_provider)
+        self.duration = meter.create_histogram('genepattern.request.duration', unit='s',
+                                               description='Latency of requests to the GenePattern server')
+
+    def __call__(self, record):
+        attributes = {'http.request.method': record['method'], 'url.template': record['endpoint'],
+                      'http.response.status_code': record['status'], 'genepattern.caller': record['caller'] or ''}
+        start = int((record['time'] - record['latency']) * 1e9)
+        span = self.tracer.start_span(f"{record['method']} {record['endpoint']}", start_time=start,
+                                      attributes={**attributes, 'http.request.body.size': record['sent'],
+                                                  'http.response.body.size': record['received']})
+        span.end(end_time=int(record['time'] * 1e9))
+        self.duration.record(record['latency'], attributes)
+
+
+"""
+GenePattern request metrics singleton
+"""
+metrics = RequestMetrics()
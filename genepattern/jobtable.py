@@ -0,0 +1,216 @@
+import html
+import threading
+from datetime import datetime, timezone
+from ipywidgets import HTML, Text, Dropdown, Button, HBox, Label, Layout
+from nbtools import UIOutput
+from .instrumentation import traced
+from .polling import job_poller
+from .shim import get_recent_jobs
+from .utils import GENEPATTERN_LOGO, session_color, server_name
+
+
+class GPJobTable(UIOutput):
+    """
+    A compact widget for displaying the status of many GenePattern jobs, one table row per job. Only the
+    current page of rows is rendered, so the table stays responsive with thousands of jobs. Rows can be
+    filtered and sorted, and are kept up to date by the session's shared JobPoller.
+    """
+    render_delay = 0.25     # Seconds to wait after an update before redrawing, so bursts of updates are drawn once
+    page_size = 50          # Number of rows rendered at a time
+    sort_columns = {'Job': 'number', 'Module': 'task', 'Status': 'status', 'Runtime': 'runtime', 'Outputs': 'outputs'}
+
+    def __init__(self, jobs=None, session=None, name='GenePattern Jobs', **kwargs):
+        """Initialize the job table"""
+        self.session = session if session is not None else (jobs[0].server_data if jobs else None)
+        self.rows = {}              # Map of row keys -> row dicts (job, params, status, error)
+        self.job_rows = {}          # Map of job numbers -> row keys, so that updates find their row directly
+        self.lock = threading.Lock()
+        self.render_timer = None
+        self.page = 0
+        self.build_controls()
+        if 'color' not in kwargs: kwargs['color'] = session_color(self.session.url if self.session else 0)
+        if 'logo' not in kwargs: kwargs['logo'] = GENEPATTERN_LOGO
+        UIOutput.__init__(self, name=name, origin=server_name(self.session.url) if self.session else '', **kwargs)
+        self.appendix.children = [self.controls, self.table]
+        for job in jobs or []: self.add_job(job)
+        self.render()
+
+    @staticmethod
+    @traced('GPJobTable')
+    def recent(session, n_jobs=100, **kwargs):
+        """Return a table of the user's most recent jobs, loaded with a single request"""
+        return GPJobTable(get_recent_jobs(session, n_jobs=n_jobs), session=session, name='Recent Jobs', **kwargs)
+
+    def build_controls(self):
+        """Create the filter, sort and paging controls"""
+        self.table = HTML()
+        self.filter = Text(placeholder='Filter jobs', continuous_update=False, layout=Layout(width='200px'))
+        self.sort = Dropdown(options=list(self.sort_columns.keys()), value='Job', layout=Layout(width='110px'))
+        self.order = Dropdown(options=['Descending', 'Ascending'], value='Descending', layout=Layout(width='120px'))
+        self.previous_button = Button(icon='chevron-left', layout=Layout(width='40px'))
+        self.next_button = Button(icon='chevron-right', layout=Layout(width='40px'))
+        self.page_label = Label()
+
+        for control in (self.filter, self.sort, self.order): control.observe(lambda change: self.turn_page(0), 'value')
+        self.previous_button.on_click(lambda b: self.turn_page(self.page - 1))
+        self.next_button.on_click(lambda b: self.turn_page(self.page + 1))
+        self.controls = HBox([self.filter, self.sort, self.order, self.previous_button, self.page_label, self.next_button])
+
+    def turn_page(self, page):
+        """Display the specified page of rows"""
+        self.page = page
+        self.render()
+
+    def expect(self, param_sets):
+        """Add a queued row for each parameter set that is about to be submitted"""
+        with self.lock:
+            for i, params in enumerate(param_sets):
+                self.set_row(i, self.make_row(None, params, 'Queued'))
+        self.schedule_render()
+
+    def add_job(self, job, params=None, key=None):
+        """Add a submitted job to the table and track its status with the session's shared poller"""
+        key = key if key is not None else job.job_number
+        with self.lock:
+            row = self.set_row(key, self.make_row(job, params if params is not None else self.rows.get(key, {}).get('params')))
+        if row['status'] in ('Submitted', 'Pending', 'Running'):
+            job_poller(job.server_data).track(job, self.poll_callback)
+        self.schedule_render()
+
+    def add_failure(self, params, error, key=None):
+        """Record a job that could not be submitted"""
+        with self.lock:
+            self.set_row(key if key is not None else len(self.rows), self.make_row(None, params, 'Error', str(error)))
+        self.schedule_render()
+
+    def poll_callback(self, job):
+        """Callback from the session's JobPoller when updated job info is received"""
+        with self.lock:
+            key = self.job_rows.get(int(job.job_number))
+            if key is None: return  # Not a job in this table
+            self.set_row(key, self.make_row(job, self.rows[key]['params']))
+        self.schedule_render()
+
+    def set_row(self, key, row):
+        """Store the row under the key, keeping the job number index up to date. Must be called holding the lock."""
+        previous = self.rows.get(key)
+        if previous is not None and previous['job'] is not None: self.job_rows.pop(previous['number'], None)
+        self.rows[key] = row
+        if row['job'] is not None: self.job_rows[row['number']] = key
+        return row
+
+    def make_row(self, job, params, status=None, error=None):
+        """Return a row dict summarizing the job, with the values used for sorting and filtering precomputed"""
+        info = job.info if job is not None and job.info else {}
+        row = {
+            'job': job,
+            'params': params,
+            'error': error,
+            'number': int(job.job_number) if job is not None else -1,
+            'task': info.get('taskName', ''),
+            'status': status if status is not None else self.job_status(job),
+            'submitted': parse_date(info.get('dateSubmitted')),
+            'completed': parse_date(info.get('dateCompleted')),
+            'outputs': info.get('numOutputFiles', len(info.get('outputFiles', []))) if info else -1,
+        }
+        values = ' '.join(str(v) for v in (params or {}).values())
+        row['search'] = f"{row['number']} {row['task']} {row['status']} {values}".lower()
+        return row
+
+    @staticmethod
+    def job_status(job):
+        """Return concise status text for the job"""
+        if not job.info: return 'Submitted'
+        status = job.info['status']
+        if status.get('hasError'): return 'Error'
+        elif status.get('completedInGp'): return 'Completed'
+        elif status.get('isPending'): return 'Pending'
+        else: return 'Running'
+
+    @staticmethod
+    def runtime(row):
+        """Return the seconds the job has run, or None if unknown"""
+        if row['submitted'] is None or row['status'] in ('Queued', 'Submitted', 'Pending'): return None
+        end = row['completed'] if row['completed'] is not None else datetime.now(timezone.utc)
+        return max((end - row['submitted']).total_seconds(), 0)
+
+    def schedule_render(self):
+        """Redraw the table shortly, unless a redraw is already scheduled"""
+        with self.lock:
+            if self.render_timer is not None: return
+            self.render_timer = threading.Timer(self.render_delay, self.render)
+            self.render_timer.daemon = True
+            self.render_timer.start()
+
+    def render(self):
+        """Draw the summary and the current page of rows"""
+        with self.lock:
+            self.render_timer = None
+            rows = list(self.rows.values())
+
+        # Summarize all jobs, for example "120 completed, 3 running"
+        counts = {}
+        for row in rows: counts[row['status']] = counts.get(row['status'], 0) + 1
+        self.status = ', '.join(f'{n} {status.lower()}' for status, n in counts.items())
+
+        # Filter and sort, then select the current page
+        query = self.filter.value.strip().lower()
+        if query: rows = [row for row in rows if query in row['search']]
+        column = self.sort_columns[self.sort.value]
+        key = (lambda r: self.runtime(r) or 0) if column == 'runtime' else (lambda r: r[column])
+        rows.sort(key=key, reverse=self.order.value == 'Descending')
+        pages = max((len(rows) - 1) // self.page_size + 1, 1)
+        self.page = min(max(self.page, 0), pages - 1)
+        start = self.page * self.page_size
+        visible = rows[start:start + self.page_size]
+
+        # Update the paging controls
+        self.page_label.value = f'{start + 1 if rows else 0}-{start + len(visible)} of {len(rows)}'
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+
+        # Only show the parameters that vary between jobs
+        varying = self.varying_params([row['params'] for row in rows if row['params']])
+        header = ''.join(f'<th>{html.escape(str(p))}</th>' for p in varying)
+        body = ''.join(self.render_row(row, varying) for row in visible)
+        self.table.value = f'<table class="gp-job-table"><thead><tr><th>Job</th><th>Module</th><th>Status</th>' \
+                           f'<th>Runtime</th><th>Outputs</th>{header}</tr></thead><tbody>{body}</tbody></table>'
+
+    def render_row(self, row, params):
+        """Return the HTML for one row of the table"""
+        job = row['job']
+        number = f'<a href="{html.escape(job.server_data.url)}/pages/index.jsf?jobid={job.job_number}" target="_blank">' \
+                 f'{job.job_number}</a>' if job is not None else ''
+        status = html.escape(row['status'])
+        if row['error']: status = f'<span title="{html.escape(row["error"])}">{status}</span>'
+        outputs = row['outputs'] if row['outputs'] >= 0 else ''
+        values = ''.join(f'<td>{html.escape(str((row["params"] or {}).get(p, "")))}</td>' for p in params)
+        return f'<tr><td>{number}</td><td>{html.escape(row["task"])}</td><td>{status}</td>' \
+               f'<td>{format_duration(self.runtime(row))}</td><td>{outputs}</td>{values}</tr>'
+
+    @staticmethod
+    def varying_params(param_sets):
+        """Return the names of the parameters whose values differ between the parameter sets"""
+        values = {}  # Map of parameter names -> set of distinct values
+        for params in param_sets:
+            for name, value in params.items(): values.setdefault(name, set()).add(str(value))
+        return [name for name, distinct in values.items() if len(distinct) > 1]
+
+
+def parse_date(date_str):
+    """Parse a date from the GenePattern REST API, returning None if missing or unparseable"""
+    if not date_str: return None
+    try:
+        date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def format_duration(seconds):
+    """Return concise text for the duration, for example 1h 5m"""
+    if seconds is None: return ''
+    seconds = int(seconds)
+    if seconds < 60: return f'{seconds}s'
+    elif seconds < 3600: return f'{seconds // 60}m {seconds % 60}s'
+    else: return f'{seconds // 3600}h {seconds % 3600 // 60}m'
@@ -1,9 +1,15 @@
-from threading import Timer
+import copy
 from urllib.error import HTTPError
-from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+from gp import GPJob
 from ipywidgets import Dropdown, Button, HTML, VBox, HBox
 from nbtools import UIOutput, EventManager, ToolManager
-from .shim import get_permissions, set_permissions, get_token, terminate_job
+from .polling import job_poller
+from .filecache import file_cache
+from .instrumentation import traced
+from .transfer import download_files
+from . import aio
+from .shim import get_info, get_permissions, get_token
 from .utils import GENEPATTERN_LOGO, server_name, session_color, is_url, redirect_url
 
 
@@ -11,18 +17,30 @@ class GPJobWidget(UIOutput):
     """A widget for representing the status of a GenePattern job"""
     sharing_displayed = False
     job = None
-
-    def __init__(self, job=None, **kwargs):
+    downloads = None
+    displayed_info = None   # Copy of the job info last displayed, used to skip unchanged updates
+    parent = None           # Widget of the parent job, which keeps this child job's status up to date
+    child_widgets = None
+    child_summary = None
+    more_button = None
+    child_page_size = 20    # Number of child jobs displayed each time more are loaded
+
+    def __init__(self, job=None, parent=None, **kwargs):
         """Initialize the job widget"""
         self.job = job
+        self.parent = parent
+        self.downloads = {}  # Map of file names -> percent downloaded
+        self.child_widgets = []  # Widgets for the child jobs loaded so far
         self.set_color(kwargs)
         self.set_logo(kwargs)
         UIOutput.__init__(self, origin=self.job_origin(), **kwargs)
-        self.poll()  # Query the GP server and begin polling, if needed
+        if self.initialized() and self.job.info: self.display_job()  # Display job info if already loaded
+        else: self.poll()  # Otherwise query the GP server and begin polling, if needed
         self.attach_detach()
         self.attach_sharing()
         self.attach_terminate()
         self.attach_duplicate()
+        self.attach_download_all()
 
         # Register the event handler for GP login
         EventManager.instance().register("gp.login", self.login_callback)
@@ -50,41 +68,67 @@ class GPJobWidget(UIOutput):
         kwargs['logo'] = GENEPATTERN_LOGO
         return kwargs['logo']
 
+    @traced('GPJobWidget')
     def poll(self):
         """Poll the GenePattern server for the job info and display it in the widget"""
         if self.initialized():
             try:  # Attempt to load the job info from the GP server
-                self.job.get_info()
+                get_info(self.job)
             except HTTPError:  # Handle HTTP errors contacting the server
                 self.name = 'Error Loading Job'
                 self.error = f'Error loading job #{self.job.job_number}'
                 return
 
-            # Add the job information to the widget
+            self.display_job()  # Add the job information to the widget
+        else:
+            # Display error message if no initialized GPJob object is provided
+            self.name = 'Not Authenticated'
+            self.error = 'You must be authenticated before the job can be displayed. After you authenticate it may take a few seconds for the information to appear.'
+
+    def poll_callback(self, job):
+        """Callback from the session's JobPoller when updated job info is received"""
+        if job is not self.job:
+            self.job.info = job.info
+            self.job.load_info()
+        self.display_job()
+
+    @traced('GPJobWidget')
+    def display_job(self):
+        """Display the loaded job info in the widget, only updating what has changed since it was last displayed"""
+        if self.initialized():
+            if self.job.info == self.displayed_info: return self.poll_if_needed()  # Nothing new to display
+            previous_info, previous_status, previous_files = self.displayed_info, self.status, self.files
+            self.displayed_info = copy.deepcopy(self.job.info)
+
+            # Add the job information to the widget, traits assigned an unchanged value are not synced
             self.name = f'{self.job.job_number}. {self.job.task_name}'
             self.origin = server_name(self.job.server_data.url)
             self.status = self.status_text()
             self.description = self.submitted_text()
             self.files = self.files_list()
-            self.visualization = self.visualizer()
 
-            # Register any output files
-            self.register_data()
+            # Register any new output files and update the visualizer
+            if previous_info is None or self.files != previous_files or \
+                    self.job.info.get('launchUrl') != previous_info.get('launchUrl'):
+                self.display_visualizer()
+                self.register_data()
 
-            # Send notification if completed
-            self.handle_notification()
+            # Send notification if the job has just completed or errored
+            if self.status != previous_status and previous_status in ('Pending', 'Running'):
+                self.handle_notification()
 
             # Update the menu items
             self.attach_terminate()
+            if previous_info is None: self.attach_duplicate()
             self.extra_file_menu_items = {
                 'Send to Code': {
                     'action': 'cell',
-                    'code': f'import genepattern\n\nfile_{self.job.job_number} = genepattern.session.get("{self.job.server_data.url}").get_job({self.job.job_number}).get_file("{{{{file_name}}}}")\nfile_{self.job.job_number}'
+                    'code': f'import genepattern\n\nfile_{self.job.job_number} = genepattern.utils.filelike(genepattern.session.get("{self.job.server_data.url}").get_job({self.job.job_number}).get_file("{{{{file_name}}}}").uri)\nfile_{self.job.job_number}'
                 },
                 'Send to Dataframe': {
                     'action': 'cell',
                     'kinds': ['gct', 'odf'],
-                    'code': f'import genepattern\nfrom gp.data import GCT as gct, ODF as odf\n\nfile_{self.job.job_number} = {{{{type}}}}(genepattern.session.get("{self.job.server_data.url}").get_job({self.job.job_number}).get_file("{{{{file_name}}}}"))\nfile_{self.job.job_number}'
+                    'code': f'import genepattern\nfrom genepattern.dataframe import read_gct as gct, read_odf as odf\n\nfile_{self.job.job_number} = {{{{type}}}}(genepattern.session.get("{self.job.server_data.url}").get_job({self.job.job_number}).get_file("{{{{file_name}}}}"))\nfile_{self.job.job_number}'
                 },
                 'Download to Workspace': {
                     'action': 'method',
@@ -94,22 +138,66 @@ class GPJobWidget(UIOutput):
             }
 
             # Handle child jobs
-            if len(self.appendix.children) == 0:
-                self.appendix.children = [GPJobWidget(child) for child in self.job.get_child_jobs()]
+            self.display_children()
 
             # Begin polling if pending or running
             self.poll_if_needed()
-        else:
-            # Display error message if no initialized GPJob object is provided
-            self.name = 'Not Authenticated'
-            self.error = 'You must be authenticated before the job can be displayed. After you authenticate it may take a few seconds for the information to appear.'
+
+    def display_visualizer(self):
+        """Resolve the visualizer URL without blocking the kernel, then display it in the widget"""
+        def display(url): self.visualization = url
+        def error(e): self.visualization = ''
+        aio.schedule(aio.run(self.visualizer), display, error)
+
+    def display_children(self, load_more=False):
+        """Summarize the status of any child jobs, displaying widgets for them a page at a time as they are requested"""
+        if 'children' not in self.job.info: return
+        children = self.job.info['children']['items']  # Included in the parent's info, no requests are made
+
+        # Update the child widgets already loaded, then load the next page if requested
+        for widget, info in zip(self.child_widgets, children):
+            widget.job.info = info
+            widget.job.load_info()
+            widget.display_job()
+        if load_more:
+            page = children[len(self.child_widgets):len(self.child_widgets) + self.child_page_size]
+            self.child_widgets += [GPJobWidget(self.child_job(info), parent=self) for info in page]
+
+        # Summarize the status of all children, for example "120 completed, 3 running"
+        counts = {}
+        for info in children:
+            status = self.status_of(info)
+            counts[status] = counts.get(status, 0) + 1
+        summary = ', '.join(f'{n} {status.lower()}' for status, n in counts.items())
+        if self.child_summary is None:
+            self.child_summary = HTML()
+            self.more_button = Button()
+            self.more_button.on_click(lambda b: self.display_children(load_more=True))
+        self.child_summary.value = f'<div class="gp-child-summary">{len(children)} child jobs: {summary}</div>'
+        appendix = [self.child_summary] + self.child_widgets
+
+        # Add the button to load the next page of child jobs, if any remain
+        remaining = len(children) - len(self.child_widgets)
+        if remaining:
+            self.more_button.description = f'Show {min(remaining, self.child_page_size)} more of {remaining}' \
+                if self.child_widgets else f'Show {min(remaining, self.child_page_size)} child jobs'
+            appendix.append(self.more_button)
+
+        if self.sharing_displayed: self.sharing_displayed = appendix  # Restored once the sharing controls are closed
+        else: self.appendix.children = appendix
+
+    def child_job(self, info):
+        """Return a GPJob for the child job, loaded from the info included in the parent's"""
+        child = GPJob(self.job.server_data, info['jobId'])
+        child.info = info
+        child.load_info()
+        return child
 
     def visualizer(self):
+        """Return the visualizer URL for the job, resolving any redirects in its parameters"""
         if not self.initialized(): return  # Ensure the job has been set
 
-        # Get the token, using the shim if necessary
-        if hasattr(self.job.server_data, 'get_token'): token = self.job.server_data.get_token()
-        else: token = get_token(self.job.server_data)
+        token = get_token(self.job.server_data)  # Get the token
 
         # Handle server-relative URLs
         if 'launchUrl' in self.job.info:
@@ -122,7 +210,7 @@ class GPJobWidget(UIOutput):
             params = parse_qs(parsed_url.query)
             for key in params.keys():
                 if is_url(params[key][0]):
-                    params[key][0] = redirect_url(params[key][0], token=token)
+                    params[key][0] = redirect_url(params[key][0], token=token, session=self.job.server_data)
             parsed_url = parsed_url._replace(query=urlencode(params, doseq=True))
 
             return parsed_url.geturl()
@@ -142,10 +230,15 @@ class GPJobWidget(UIOutput):
         return ''
 
     def poll_if_needed(self):
-        """Begin a polling interval if the job is pending or running"""
+        """Track the job with the session's shared poller if the job is pending or running"""
+        if self.parent is not None: return  # Child jobs are updated along with their parent
         if self.status == 'Pending' or self.status == 'Running':
-            timer = Timer(15.0, lambda: self.poll())
-            timer.start()
+            job_poller(self.job.server_data).track(self.job, self.poll_callback)
+
+    def poll_stats(self):
+        """Return the poll count and observed latency for this job, as tracked by the session's poller"""
+        if not self.initialized(): return None  # Ensure the job has been set
+        return job_poller(self.job.server_data).poll_stats(self.job.job_number)
 
     def submitted_text(self):
         """Return pretty job submission text"""
@@ -166,11 +259,16 @@ class GPJobWidget(UIOutput):
     def status_text(self):
         """Return concise status text"""
         if not self.initialized(): return ''  # Ensure the job has been set
-        if 'hasError' in self.job.info['status'] and self.job.info['status']['hasError']:
+        return self.status_of(self.job.info)
+
+    @staticmethod
+    def status_of(info):
+        """Return concise status text for the job info"""
+        if 'hasError' in info['status'] and info['status']['hasError']:
             return 'Error'
-        elif 'completedInGp' in self.job.info['status'] and self.job.info['status']['completedInGp']:
+        elif 'completedInGp' in info['status'] and info['status']['completedInGp']:
             return 'Completed'
-        elif 'isPending' in self.job.info['status'] and self.job.info['status']['isPending']:
+        elif 'isPending' in info['status'] and info['status']['isPending']:
             return 'Pending'
         else:
             return 'Running'
@@ -203,18 +301,28 @@ class GPJobWidget(UIOutput):
 
     def attach_duplicate(self):
         session_index = f'"{self.job.server_data.url}"' if self.job.server_data else 0
+        lsid = f', lsid="{self.job.task_lsid}"' if self.job.task_lsid else ''  # Lets the module load concurrently
         self.extra_menu_items = {**self.extra_menu_items, **{'Duplicate Analysis': {
             'action': 'cell',
-            'code': f"genepattern.display(genepattern.reproduce_job(genepattern.session, {session_index}, {self.job.job_number}))"
+            'code': f"genepattern.display(genepattern.reproduce_job(genepattern.session, {session_index}, {self.job.job_number}{lsid}))"
         }}}
 
-    def build_sharing_controls(self):
+        # Duplicate every step of a pipeline in one batch
+        children = [c['jobId'] for c in self.job.info.get('children', {}).get('items', [])] if self.job.info else []
+        if children: self.extra_menu_items = {**self.extra_menu_items, **{'Duplicate All Steps': {
+            'action': 'cell',
+            'code': f"genepattern.display(genepattern.reproduce_jobs(genepattern.session, {session_index}, [{', '.join(children)}]))"
+        }}}
+
+    def attach_download_all(self):
+        self.extra_menu_items = {**self.extra_menu_items, **{'Download All to Workspace': {
+            'action': 'method',
+            'code': 'workspace_download_all'
+        }}}
+
+    def build_sharing_controls(self, perms=None):
         """Create and return a VBox with the job sharing controls"""
-        # Query job permissions, using the shim if necessary
-        if hasattr(self.job, 'get_permissions'):
-            perms = self.job.get_permissions()
-        else:
-            perms = get_permissions(self.job)
+        if perms is None: perms = get_permissions(self.job)  # Query job permissions if not provided
         group_widgets = []
 
         # Build the job sharing form by iterating over groups
@@ -238,6 +346,7 @@ class GPJobWidget(UIOutput):
         cancel_button.on_click(lambda b: self.toggle_job_sharing())
 
         # Save sharing permissions functionality
+        @traced('GPJobWidget')
         def save_permissions(button):
             save_perms = []
             for g in group_widgets:
@@ -250,11 +359,9 @@ class GPJobWidget(UIOutput):
                     save_perms.append({'id': group_name, 'read': True, 'write': False})
                 else:
                     save_perms.append({'id': group_name, 'read': False, 'write': False})
-            # Save the permissions, using the shim if necessary
-            if hasattr(self.job, 'set_permissions'):
-                self.job.set_permissions(save_perms)
-            else:
-                set_permissions(self.job, save_perms)
+            # Save the permissions without blocking the kernel
+            def save_error(e): self.error = f'Error saving sharing permissions for job #{self.job.job_number}'
+            aio.schedule(aio.set_permissions(self.job, save_perms), error_callback=save_error)
             self.toggle_job_sharing()
 
         save_button = Button(description='Save', button_style='info')
@@ -266,6 +373,7 @@ class GPJobWidget(UIOutput):
         # Create the job sharing box and attach to the job widget
         return VBox(children=[title] + group_widgets + [button_box])
 
+    @traced('GPJobWidget')
     def toggle_job_sharing(self):
         """Toggle displaying the job sharing controls off and on"""
         # Handle None's
@@ -276,23 +384,68 @@ class GPJobWidget(UIOutput):
             self.appendix.children = self.sharing_displayed if self.sharing_displayed is not True else []
             self.sharing_displayed = False
         else:
-            # Create the job sharing box
-            permissions_box = self.build_sharing_controls()
             # Save any child widgets in the appendix so that they're available when toggled back on
             self.sharing_displayed = self.appendix.children if self.appendix.children else True
-            # Attach to the job widget
-            self.appendix.children = [permissions_box]
 
+            # Query the permissions without blocking the kernel, then create and attach the job sharing box
+            def display_sharing_controls(perms):
+                if self.sharing_displayed: self.appendix.children = [self.build_sharing_controls(perms)]
+            def display_sharing_error(e):
+                self.error = f'Error loading sharing permissions for job #{self.job.job_number}'
+            aio.schedule(aio.get_permissions(self.job), display_sharing_controls, display_sharing_error)
+
+    @traced('GPJobWidget')
     def terminate_job(self):
         if self.initialized():
-            # Terminate using the shim if necessary
-            self.job.terminate() if hasattr(self.job, 'terminate') else terminate_job(self.job)
-            self.poll()
+            # Terminate without blocking the kernel, then update the job status
+            def terminate_error(e): self.error = f'Error terminating job #{self.job.job_number}'
+            aio.schedule(aio.terminate_job(self.job), lambda _: self.poll(), terminate_error)
 
     def workspace_download(self, file_name="AG.chip.cvt.chip"):
-        with open(file_name, 'wb') as f:
-            with self.job.get_file(file_name).open() as g:
-                f.write(g.read())
+        """Stream the output file to the workspace without blocking the kernel, displaying progress in the widget"""
+        file = self.output_file(file_name)
+        if file is None:
+            self.error = f'Cannot find output file: {file_name}'
+            return
+        self.download([file])
+
+    def workspace_download_all(self):
+        """Concurrently download all of the job's output files to the workspace"""
+        if not self.initialized() or not self.job.output_files: return
+        self.download([self.output_file_tuple(f) for f in self.job.output_files])
+
+    @traced('GPJobWidget')
+    def download(self, files):
+        """Download the list of (url, name, size) tuples in the background"""
+        for _, name, _ in files: self.downloads[name] = 0
+
+        def complete(_):
+            for _, name, _ in files: self.downloads.pop(name, None)
+            self.info = f'Downloaded {", ".join(name for _, name, _ in files)} to workspace'
+        def error(e):
+            for _, name, _ in files: self.downloads.pop(name, None)
+            self.error = f'Error downloading to workspace: {e}'
+        aio.schedule(aio.run(download_files, self.job.server_data, files, progress=self.download_progress, cache=file_cache), complete, error)
+
+    def download_progress(self, name, done, total):
+        """Display the progress of all current downloads, updating at most once per percent"""
+        percent = int(done * 100 / total) if total else None
+        if self.downloads.get(name) == percent: return
+        self.downloads[name] = percent
+        self.info = 'Downloading ' + ', '.join(f'{n} ({p}%)' if p is not None else n for n, p in self.downloads.items())
+
+    def output_file(self, file_name):
+        """Return a (url, name, size) tuple for the output file with the given name, or None if not found"""
+        if not self.initialized() or not self.job.output_files: return None
+        for f in self.job.output_files:
+            if self.output_file_tuple(f)[1] == file_name: return self.output_file_tuple(f)
+        return None
+
+    @staticmethod
+    def output_file_tuple(file_info):
+        """Return a (url, name, size) tuple for the output file entry in the job info"""
+        url = file_info['link']['href']
+        return url, unquote(url.split('/')[-1]), file_info.get('fileLength')
 
     def initialized(self):
         """Has the widget been initialized with session credentials"""
@@ -0,0 +1,381 @@
+import json
+import logging
+from abc import ABC, abstractmethod
+import random
+import threading
+import time
+from urllib.error import HTTPError
+from requests import RequestException
+from .instrumentation import traced
+from .sessions import session as sessions
+from .shim import rest_request, get_info, get_jobs, retry_delay
+
+
+logger = logging.getLogger(__name__)
+
+class PollingPolicy:
+    """
+    Schedule for how often a job is polled. Jobs are polled quickly at first, backing off exponentially
+    up to a ceiling. Jitter is applied to each interval so that large batches of jobs don't synchronize.
+    """
+
+    def __init__(self, initial=2.0, factor=1.5, ceiling=60.0, jitter=0.2):
+        self.initial = initial      # Seconds before the first poll
+        self.factor = factor        # Multiplier applied to the interval after each poll
+        self.ceiling = ceiling      # Maximum seconds between polls
+        self.jitter = jitter        # Fraction of the interval to randomly add or subtract
+
+    def interval(self, polls):
+        """Return the seconds to wait before the next poll, given the number of times the job has been polled"""
+        delay = min(self.initial * (self.factor ** polls), self.ceiling)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class PollStats:
+    """Per-job polling statistics, exposed for tuning the polling policy"""
+
+    def __init__(self, next_poll):
+        self.polls = 0              # Number of times the job has been polled
+        self.latency = None         # Latency of the most recent request, in seconds
+        self.total_latency = 0.0    # Summed latency of all requests, in seconds
+        self.next_poll = next_poll  # Monotonic time of the next scheduled poll
+
+    def record(self, latency):
+        self.polls += 1
+        self.latency = latency
+        self.total_latency += latency
+
+    def to_dict(self):
+        return {
+            'polls': self.polls,
+            'latency': self.latency,
+            'mean_latency': self.total_latency / self.polls if self.polls else None,
+            'next_poll': max(self.next_poll - time.monotonic(), 0),
+        }
+
+
+class JobPoller:
+    """
+    Polls the GenePattern server for the status of all pending and running jobs in a session.
+    Tracked jobs are queried in batches using the job list endpoint, falling back to individual
+    job queries for any job not included in the batch, and the results are fanned out to the
+    registered callbacks. Jobs are no longer tracked once they reach a terminal state.
+
+    If the server pushes job status events, these are dispatched as they arrive and polling
+    slows to the policy's ceiling, serving only as a safety net.
+    """
+    policy = PollingPolicy()    # Default policy, may be overridden per poller
+    page_margin = 20            # Extra jobs to request per batch, covers jobs submitted after the tracked ones
+    batch_window = 1.0          # Jobs due within this many seconds are polled in the same round
+
+    def __init__(self, session, policy=None):
+        self.session = session
+        if policy is not None: self.policy = policy
+        self.jobs = {}                  # Map of job numbers -> tracked GPJob objects
+        self.callbacks = {}             # Map of job numbers -> list of registered callbacks
+        self.stats = {}                 # Map of job numbers -> PollStats
+        self.lock = threading.RLock()   # Protects the maps, widgets register from multiple threads
+        self.timer = None
+        self.timer_due = None           # Monotonic time the running timer fires
+        self.backoff_until = 0          # Monotonic time before which the server asked not to be polled
+        self.stream = EventStream(self) # Push transport, used in preference to polling when available
+
+    def track(self, job, callback):
+        """Begin tracking the job, calling the callback with the GPJob each time new job info is received"""
+        with self.lock:
+            self.jobs[job.job_number] = job
+            callbacks = self.callbacks.setdefault(job.job_number, [])
+            if callback not in callbacks: callbacks.append(callback)
+            if job.job_number not in self.stats:
+                self.stats[job.job_number] = PollStats(time.monotonic() + self.interval(0))
+        self.stream.start()
+        self.schedule()
+
+    def untrack(self, job_number, callback=None):
+        """Stop tracking the job, or only remove the specified callback"""
+        with self.lock:
+            if callback is not None and callback in self.callbacks.get(job_number, []):
+                self.callbacks[job_number].remove(callback)
+            if callback is None or not self.callbacks.get(job_number):
+                self.jobs.pop(job_number, None)
+                self.callbacks.pop(job_number, None)
+                if not self.jobs: self.stream.stop()  # Nothing left to listen for
+
+    def tracked(self):
+        """Return the list of job numbers currently being tracked"""
+        with self.lock: return list(self.jobs.keys())
+
+    def poll_stats(self, job_number=None):
+        """Return the polling statistics for the job, or a map of job numbers -> statistics for all polled jobs"""
+        with self.lock:
+            if job_number is not None: return self.stats[job_number].to_dict() if job_number in self.stats else None
+            return {n: s.to_dict() for n, s in self.stats.items()}
+
+    def schedule(self):
+        """Start the polling timer for the next due job, if one is not already set to fire sooner"""
+        with self.lock:
+            if not self.jobs: return
+            due = max(min(self.stats[n].next_poll for n in self.jobs), self.backoff_until)
+            if self.timer is not None:
+                if self.timer_due <= due: return
+                self.timer.cancel()
+            self.timer_due = due
+            self.timer = threading.Timer(max(due - time.monotonic(), 0), self.poll)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stop(self):
+        """Cancel any pending polling round"""
+        with self.lock:
+            if self.timer is not None: self.timer.cancel()
+            self.timer = None
+        self.stream.stop()
+
+    def interval(self, polls):
+        """Return the seconds until the next poll, only polling as a safety net while push updates are received"""
+        return self.policy.ceiling if self.stream.connected else self.policy.interval(polls)
+
+    def push_lost(self):
+        """Called when the push transport disconnects, resume polling on the regular schedule"""
+        with self.lock:
+            now = time.monotonic()
+            for job_number in self.jobs:
+                stats = self.stats[job_number]
+                stats.next_poll = min(stats.next_poll, now + self.policy.interval(stats.polls))
+        self.schedule()
+
+    def poll(self):
+        """Query the server for all tracked jobs that are due and dispatch the results"""
+        with self.lock:
+            self.timer = None
+            window = time.monotonic() + self.batch_window
+            jobs = {n: job for n, job in self.jobs.items() if self.stats[n].next_poll <= window}
+
+        try:
+            results, latencies, delay = self.fetch(jobs)
+        except Exception:
+            logger.exception('Error polling GenePattern jobs')
+            results, latencies, delay = {}, {}, 0  # Try again on the regular schedule
+
+        try:
+            now = time.monotonic()
+            if delay: self.backoff_until = now + delay
+
+            for job_number, job in jobs.items():
+                with self.lock:
+                    stats = self.stats[job_number]
+                    if job_number in latencies: stats.record(latencies[job_number])
+                    stats.next_poll = max(now + self.interval(stats.polls), self.backoff_until)
+                if job_number in results: self.dispatch(job_number, results[job_number])
+        finally:
+            self.schedule()  # Always keep polling, one failed round must not stop updates for the session
+
+    def dispatch(self, job_number, info):
+        """Load the new info into the tracked job and call its registered callbacks"""
+        with self.lock:
+            job = self.jobs.get(job_number)
+            callbacks = list(self.callbacks.get(job_number, []))
+        if job is None: return
+
+        job.info = info
+        job.load_info()
+        for callback in callbacks:
+            try: callback(job)
+            except Exception: logger.exception(f'Error updating job #{job_number}')
+
+        if is_terminal(job.info): self.untrack(job_number)
+
+    @traced('JobPoller')
+    def fetch(self, jobs):
+        """Return a map of job numbers -> job info, a map of job numbers -> request latency and any
+           delay requested by the server, batching requests where possible"""
+        results, latencies, delay = {}, {}, 0
+        owned = [n for n, job in jobs.items() if job.user_id is None or job.user_id == self.session.username]
+
+        # Query the job list once for all jobs owned by the session's user
+        if owned:
+            start = time.monotonic()
+            try:
+                items, headers = get_jobs(self.session, page_size=len(owned) + self.page_margin)
+                delay = retry_delay(headers)
+                for info in items:
+                    job_number = int(info['jobId'])
+                    if job_number in jobs: results[job_number] = info
+                for job_number in owned: latencies[job_number] = time.monotonic() - start
+            except HTTPError as e:
+                delay = retry_delay(e.headers)
+                if e.code in (429, 503): return results, latencies, delay  # Rate limited, wait to try again
+            except (RequestException, OSError):
+                return results, latencies, delay  # Server unreachable, try again next round
+
+        # Query any remaining jobs individually
+        for job_number, job in jobs.items():
+            if job_number in results: continue
+            start = time.monotonic()
+            try:
+                results[job_number] = get_info(job).info
+                latencies[job_number] = time.monotonic() - start
+            except HTTPError as e:
+                delay = max(delay, retry_delay(e.headers))
+                if e.code in (429, 503): break  # Rate limited, wait to try again
+            except (RequestException, OSError):
+                break  # Server unreachable, try again next round
+        return results, latencies, delay
+
+
+class PushUnsupported(Exception):
+    """Raised by a push transport when the server does not push job status events"""
+
+
+class PushTransport(ABC):
+    """
+    Interface of the transports used by EventStream to receive job status events pushed by the server.
+    A transport is created for each session, connected, and its events iterated until the connection
+    closes, after which it may be connected again.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    @abstractmethod
+    def connect(self):
+        """Open the connection, raising PushUnsupported if the server does not push events"""
+
+    @abstractmethod
+    def events(self):
+        """Yield a dict with the 'event' type and JSON 'data' of each event received, until the connection closes"""
+
+    def close(self):
+        """Close the connection, ending any iteration of events()"""
+
+
+class SSETransport(PushTransport):
+    """Receives job status events from the GenePattern server's server-sent events endpoint, resuming
+       from the last event received when reconnected"""
+    endpoint = '/rest/v1/jobs/events'   # Server-relative SSE endpoint
+    heartbeat = 90                      # Seconds of silence before the connection is presumed dead
+
+    def __init__(self, session):
+        PushTransport.__init__(self, session)
+        self.last_event_id = None
+        self.response = None
+
+    def connect(self):
+        headers = {'Accept': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        if self.last_event_id is not None: headers['Last-Event-ID'] = self.last_event_id
+        response = rest_request(self.session, 'GET', f'{self.session.url}{self.endpoint}', headers=headers,
+                                stream=True, timeout=(sessions.timeout, self.heartbeat))
+        if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+            response.close()  # Some other page was returned, for example a login redirect
+            raise PushUnsupported(f'{self.endpoint} is not an event stream')
+        self.response = response
+
+    def events(self):
+        event = {}
+        for line in self.response.iter_lines(chunk_size=None, decode_unicode=True):  # Yield each chunk as it arrives
+            if line: self.parse_line(line, event)
+            else:  # A blank line ends the event
+                if 'data' in event: yield {'event': event.get('event', 'status'), 'data': event['data']}
+                event = {}
+
+    def parse_line(self, line, event):
+        """Parse one line of the event stream into the event being built"""
+        if line.startswith(':'): return  # Comment, used by servers as a keep-alive
+        field, _, value = line.partition(':')
+        if value.startswith(' '): value = value[1:]
+        if field == 'data': event['data'] = f'{event["data"]}\n{value}' if 'data' in event else value
+        elif field == 'id': self.last_event_id = value
+        elif field == 'event': event['event'] = value
+
+    def close(self):
+        if self.response is not None: self.response.close()
+
+
+class EventStream:
+    """
+    Receives the job status pushed by the GenePattern server and dispatches each status event to the poller
+    as it arrives. Events are received through a pluggable transport, by default server-sent events, and
+    dropped connections are reestablished. If the server does not push events, the stream gives up and the
+    poller's regular polling is used instead.
+    """
+    transport = SSETransport                                # PushTransport class used for each session, None disables push
+    reconnect = PollingPolicy(initial=1.0, factor=2.0)      # Backoff between reconnection attempts
+
+    def __init__(self, poller):
+        self.poller = poller
+        self.supported = self.transport is not None  # Set to False once the server is known not to push events
+        self.connection = self.transport(poller.session) if self.supported else None
+        self.connected = False
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        """Begin listening for events in a background thread, if not already listening"""
+        self.stopped = False
+        if not self.supported or (self.thread is not None and self.thread.is_alive()): return
+        self.thread = threading.Thread(target=self.run, name='genepattern-events', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop listening for events and close the connection"""
+        self.stopped = True
+        if self.connection is not None: self.connection.close()
+
+    def run(self):
+        """Listen for events, reconnecting after failures until stopped or push is found to be unsupported"""
+        failures = 0
+        while not self.stopped and self.supported:
+            try:
+                self.listen()
+                failures = 0
+            except PushUnsupported:
+                self.supported = False
+            except HTTPError as e:
+                # Servers without push answer the endpoint with a client error, which need not be a 404.
+                # Server errors may be transient, so are retried with backoff.
+                if e.code < 500: self.supported = False
+            except Exception:
+                pass  # Dropped connection, malformed event or closed by stop(), reconnect unless stopped
+            finally:
+                if self.connected:
+                    self.connected = False
+                    self.poller.push_lost()
+            if self.stopped or not self.supported: break
+            time.sleep(self.reconnect.interval(failures))
+            failures += 1
+
+    @traced('EventStream')
+    def listen(self):
+        """Connect the transport and dispatch events until the connection closes"""
+        self.connection.connect()
+        self.connected = True
+        for event in self.connection.events():
+            if self.stopped: return
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        """Pass the job info in a status event to the poller, merged into any info already loaded"""
+        if event['event'] != 'status': return
+        info = json.loads(event['data'])
+        job_number = int(info['jobId'])
+        with self.poller.lock: job = self.poller.jobs.get(job_number)
+        if job is None: return  # Not a job being tracked
+        self.poller.dispatch(job_number, {**job.info, **info} if job.info else info)
+
+
+def is_terminal(info):
+    """Has the job described by the job info finished, either successfully or with an error"""
+    status = info.get('status', {}) if info else {}
+    return bool(status.get('isFinished') or status.get('hasError') or status.get('completedInGp'))
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def job_poller(session):
+    """Return the shared JobPoller for the session, lazily creating one if necessary"""
+    key = (session.url, session.username)
+    with _pollers_lock:
+        if key not in _pollers: _pollers[key] = JobPoller(session)
+        return _pollers[key]
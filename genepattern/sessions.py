@@ -1,12 +1,26 @@
 import gp
+import requests
+import threading
 import warnings
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+from .instrumentation import metrics
 
 
 class SessionList:
     """
-    Keeps a list of all currently registered GenePattern server sessions
+    Keeps a list of all currently registered GenePattern server sessions, indexed by normalized server URL
+    and by origin so that sessions can be looked up by URL or file URL in constant time
     """
     sessions = []
+    index = {}              # Map of normalized server URLs -> position in the sessions list
+    origins = {}            # Map of server origins -> list of normalized server URLs at that origin
+    lock = threading.RLock()  # Sessions are read from polling threads while being registered
+    http_sessions = {}      # Map of server origins -> pooled requests.Session objects
+    pool_size = 10          # Maximum number of keep-alive connections per server
+    timeout = 30            # Seconds to wait for the server to connect or respond
+    retries = 3             # Number of times to retry failed connections and idempotent requests
 
     def register(self, server, username, password):
         """
@@ -24,17 +38,21 @@ class SessionList:
         # Validate username if not empty
         valid_username = username != "" and username is not None
 
-        # Validate that the server is not already registered
-        index = self._get_index(server)
-        new_server = index == -1
+        with self.lock:
+            # Validate that the server is not already registered
+            index = self._get_index(server)
+            new_server = index == -1
 
-        # Add the new session to the list
-        if valid_username and new_server:
-            self.sessions.append(session)
+            # Add the new session to the list
+            if valid_username and new_server:
+                url = self.normalize(server)
+                self.index[url] = len(self.sessions)
+                self.origins.setdefault(self.origin(url), []).append(url)
+                self.sessions.append(session)
 
-        # Replace old session is one exists
-        if valid_username and not new_server:
-            self.sessions[index] = session
+            # Replace old session is one exists
+            if valid_username and not new_server:
+                self.sessions[index] = session
 
         return session
 
@@ -46,19 +64,39 @@ class SessionList:
         :return:
         """
 
-        # Handle indexes
-        if isinstance(server, int):
-            if server >= len(self.sessions):
+        with self.lock:
+            # Handle indexes
+            if isinstance(server, int):
+                if server >= len(self.sessions):
+                    return None
+                else:
+                    return self.sessions[server]
+
+            # Handle server URLs
+            index = self._get_index(server)
+            if index == -1:
                 return None
             else:
-                return self.sessions[server]
+                return self.sessions[index]
 
-        # Handle server URLs
-        index = self._get_index(server)
-        if index == -1:
+    def find(self, file_url):
+        """
+        Returns the registered GPServer object for the server hosting the file URL
+        Returns None if the URL isn't on a registered server
+        :param file_url:
+        :return:
+        """
+        parsed = urlparse(file_url)
+        with self.lock:
+            servers = self.origins.get(f'{parsed.scheme.lower()}://{parsed.netloc.lower()}')
+            if not servers: return None
+            if len(servers) == 1: return self.sessions[self.index[servers[0]]]
+
+            # More than one server at this origin, pick the one whose path the file is under
+            path = parsed.path.rstrip('/') + '/'
+            for url in sorted(servers, key=len, reverse=True):
+                if path.startswith(urlparse(url).path + '/'): return self.sessions[self.index[url]]
             return None
-        else:
-            return self.sessions[index]
 
     def make(self, server):
         """
@@ -72,25 +110,85 @@ class SessionList:
         elif isinstance(server, int): raise RuntimeError('make() does not support session indexes')
         else: return gp.GPServer(server, None, None)
 
+    def http(self, url):
+        """
+        Returns the pooled, keep-alive HTTP session used for all requests to the server at the given URL,
+        lazily creating one if needed
+        :param url:
+        :return:
+        """
+        origin = self.origin(url)
+        if origin in self.http_sessions: return self.http_sessions[origin]
+        with self.lock:
+            if origin in self.http_sessions: return self.http_sessions[origin]
+            # Only gateway errors are retried here. Rate limits and 503s are returned to the caller with their
+            # Retry-After and rate limit headers, so that it can back off rather than sleep in a request thread.
+            retry = Retry(total=self.retries, backoff_factor=0.5, status_forcelist=(502, 504),
+                          respect_retry_after_header=False, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+            http = requests.Session()
+            http.headers['User-Agent'] = 'GenePatternRest'
+            http.hooks['response'].append(metrics.hook)  # Record requests when instrumentation is enabled
+            http.mount('http://', adapter)
+            http.mount('https://', adapter)
+            self.http_sessions[origin] = http
+            return http
+
+    def configure_http(self, pool_size=None, timeout=None, retries=None):
+        """
+        Set the connection pool size, timeout and retry policy used for requests to GenePattern servers.
+        Existing HTTP sessions are closed and recreated with the new settings on their next use.
+        :param pool_size:
+        :param timeout:
+        :param retries:
+        :return:
+        """
+        if pool_size is not None: self.pool_size = pool_size
+        if timeout is not None: self.timeout = timeout
+        if retries is not None: self.retries = retries
+        for http in self.http_sessions.values(): http.close()
+        self.http_sessions = {}
+
     def clean(self):
         """
         Clear all GenePattern sessions from the sessions list
         :return:
         """
-        self.sessions = []
+        with self.lock:
+            self.sessions = []
+            self.index = {}
+            self.origins = {}
 
     def _get_index(self, server_url):
         """
-        Returns a registered GPServer object with a matching GenePattern server url
+        Returns the position of the registered GPServer object with a matching GenePattern server url
         Returns -1 if no matching result was found
         :param server_url:
         :return:
         """
-        for i in range(len(self.sessions)):
-            session = self.sessions[i]
-            if session.url == server_url:
-                return i
-        return -1
+        return self.index.get(self.normalize(server_url), -1)
+
+    @staticmethod
+    def normalize(server_url):
+        """
+        Returns the server URL in canonical form, with a lowercase scheme and host, no trailing slash and ending in /gp
+        :param server_url:
+        :return:
+        """
+        parsed = urlparse(server_url.strip())
+        path = parsed.path.rstrip('/')
+        if not path.endswith('/gp'): path += '/gp'
+        return f'{parsed.scheme.lower()}://{parsed.netloc.lower()}{path}'
+
+    @staticmethod
+    def origin(url):
+        """
+        Returns the scheme://host:port origin of the URL, in lowercase
+        :param url:
+        :return:
+        """
+        parsed = urlparse(url)
+        return f'{parsed.scheme.lower()}://{parsed.netloc.lower()}'
 
 
 """
@@ -1,15 +1,34 @@
 from io import StringIO
+from email.utils import parsedate_to_datetime
 from html.parser import HTMLParser
-from gp import GPTask, GPTaskParam
+from urllib.error import HTTPError
+import gp
+from gp import GPJob, GPTask, GPTaskParam
+from .cache import task_cache, is_versioned_lsid
+from .sessions import session as sessions
+from .tokens import request_token, token_manager
+from .utils import ensure_safe_url
 import json
-import requests
+import time
 import urllib.parse
-import urllib.request
+
+
+def rest_request(session, method, url, authorize=True, **kwargs):
+    """Make a request using the pooled HTTP session for the GenePattern server, raising HTTPError on failure"""
+    headers = kwargs.pop('headers', {})
+    if authorize and session.authorization_header() is not None:
+        headers['Authorization'] = session.authorization_header()
+    kwargs.setdefault('timeout', sessions.timeout)
+
+    response = sessions.http(url).request(method, url, headers=headers, **kwargs)
+    if response.status_code >= 400:
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return response
 
 
 def get_token(session):
-    if not hasattr(session, 'token') or not session.token:
-        session.token = session.login()
+    """Return a valid token for the session, shared with all other sessions for the same server and user"""
+    session.token = token_manager.token(session)
     return session.token
 
 
@@ -28,63 +47,129 @@ def get_kinds(param):
 
 def get_permissions(job):
     url = f'{job.server_data.url}/rest/v1/jobs/{job.job_number}/permissions'
-    request = urllib.request.Request(url)
-    if job.server_data.authorization_header() is not None:
-        request.add_header('Authorization', job.server_data.authorization_header())
-    request.add_header('User-Agent', 'GenePatternRest')
-
-    response = urllib.request.urlopen(request)
-    return json.loads(response.read())
+    return rest_request(job.server_data, 'GET', url).json()
 
 
 def set_permissions(job, permissions):
     url = f'{job.server_data.url}/rest/v1/jobs/{job.job_number}/permissions'
-    data = json.dumps(permissions).encode('utf8')
-    request = urllib.request.Request(url, data=data, method='PUT')
-    if job.server_data.authorization_header() is not None:
-        request.add_header('Authorization', job.server_data.authorization_header())
-    request.add_header('User-Agent', 'GenePatternRest')
-    urllib.request.urlopen(request)
+    rest_request(job.server_data, 'PUT', url, data=json.dumps(permissions).encode('utf8'))
 
 
 def login(session):
-    safe_url = ensure_safe_url(session.url)
-    safe_username = urllib.parse.quote(session.username)
-    safe_password = urllib.parse.quote(session.password)
-
-    url = f"{safe_url}/rest/v1/oauth2/token?grant_type=password&username={safe_username}&password={safe_password}&client_id=GenePatternNotebook-{safe_username}"
-    response = requests.post(url)
-
-    try:
-        response.raise_for_status()
-        return response.json()['access_token']
-    except requests.exceptions.Timeout:
-        raise TimeoutError('Connection timed out attempting to contact GenePattern server')
-    except requests.exceptions.TooManyRedirects:
-        raise TimeoutError('Bad GenePattern server URL')
-    except requests.exceptions.RequestException as e:
-        raise TimeoutError('Invalid username or password')
+    """Log in to the GenePattern server with the session's credentials, returning a new access token"""
+    return request_token(session)['access_token']
 
 
 def system_message(session):
     safe_url = ensure_safe_url(session.url)
     url = f"{safe_url}/rest/v1/config/system-message"
-    response = requests.get(url)
+    response = sessions.http(url).get(url, timeout=sessions.timeout)
     return strip_html(response.text)
 
 
 def get_task(session, lsid_or_name):
     url = f'{session.url}/rest/v1/tasks/{lsid_or_name}/'
-    request = urllib.request.Request(url)
-    if session.authorization_header() is not None:
-        request.add_header('Authorization', session.authorization_header())
-    request.add_header('User-Agent', 'GenePatternRest')
-
-    response = urllib.request.urlopen(request)
-    task_dict = json.loads(response.read())
+    task_dict = rest_request(session, 'GET', url).json()
     return GPTask(session, task_dict['lsid'], task_dict)
 
 
+def get_task_list(session):
+    """Query the server for the list of installed modules, returning GPTask objects"""
+    response = rest_request(session, 'GET', f'{session.url}/rest/v1/tasks/all.json')
+    return [GPTask(session, task_dict['lsid'], task_dict) for task_dict in response.json()['all_modules']]
+
+
+def param_load(task, refresh=False):
+    """Load the task's parameters and metadata and assign them to the GPTask object.
+       Versioned LSIDs are served from the local task cache without contacting the server, while
+       name-based lookups are revalidated using ETag or Last-Modified. Pass refresh=True to bypass the cache."""
+    session = task.server_data
+    cached = None if refresh else task_cache.get(session, task.uri)
+    if cached and is_versioned_lsid(task.uri):
+        load_dto(task, cached['json'])
+        return task
+
+    # Make a conditional request if a cached copy can be revalidated
+    headers = {}
+    if cached and cached['etag']: headers['If-None-Match'] = cached['etag']
+    if cached and cached['last_modified']: headers['If-Modified-Since'] = cached['last_modified']
+    url = f'{session.url}/rest/v1/tasks/{urllib.parse.quote(task.uri)}'
+    response = rest_request(session, 'GET', url, headers=headers)
+    if response.status_code == 304:
+        load_dto(task, cached['json'])
+        return task
+    load_dto(task, response.text)
+
+    # Cache the metadata, unless it includes user state that may change, such as a pending license agreement
+    if not task.dto.get('eulaInfo', {}).get('pendingEulas'):
+        task_cache.put(session, task.lsid, response.text)
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if task.uri != task.lsid and (etag or last_modified):
+            task_cache.put(session, task.uri, response.text, etag, last_modified)
+    return task
+
+
+def load_dto(task, json_str):
+    """Parse the task JSON and assign its metadata to the GPTask object, as GPTask.param_load() does"""
+    task.json = json_str
+    task.dto = json.loads(json_str)
+    task.description = task.dto['description'] if 'description' in task.dto else ""
+    task.name = task.dto['name']
+    task.documentation = task.dto['documentation'] if 'documentation' in task.dto else ""
+    task.lsid = task.dto['lsid']
+    task.version = task.dto['version'] if 'version' in task.dto else ""
+    task.params = [GPTaskParam(task, param) for param in task.dto['params']]
+    task._params_loaded = True
+
+
+def get_info(job):
+    """Query the server for the job's info and assign it to the GPJob object"""
+    url = f'{job.server_data.url}/rest/v1/jobs/{job.job_number}?includeInputParams=true'
+    job.json = rest_request(job.server_data, 'GET', url).text
+    job.info = json.loads(job.json)
+    job.load_info()
+    return job
+
+
+def get_jobs(session, page_size=10, user_id=None):
+    """Query the job list endpoint, returning the info for the user's most recent jobs and the response headers"""
+    user_id = session.username if user_id is None else user_id
+    url = f'{session.url}/rest/v1/jobs/?pageSize={page_size}&userId={urllib.parse.quote(user_id)}&orderBy=-dateSubmitted'
+    response = rest_request(session, 'GET', url)
+    return response.json()['items'], response.headers
+
+
+def get_recent_jobs(session, n_jobs=10):
+    """Return GPJob objects for the user's most recently submitted jobs"""
+    jobs, _ = get_jobs(session, page_size=n_jobs)
+    job_list = []
+    for info in jobs:
+        job = GPJob(session, info['jobId'])
+        job.info = info
+        job.load_info()
+        job_list.append(job)
+    return job_list
+
+
+def retry_delay(headers):
+    """Return the seconds to wait before the next request, as requested by Retry-After or rate limit headers"""
+    if headers is None: return 0
+
+    # Handle Retry-After, given either in seconds or as an HTTP date
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        if retry_after.strip().isdigit(): return float(retry_after)
+        try: return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError): pass
+
+    # Handle exhausted rate limits, reset given either in seconds or as an epoch timestamp
+    remaining, reset = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Reset')
+    if remaining is not None and remaining.strip() == '0' and reset and reset.strip().isdigit():
+        reset = float(reset)
+        return max(reset - time.time(), 0) if reset > 1e9 else reset
+    return 0
+
+
 class HTMLStripper(HTMLParser):
     """Parse HTML blob and strip out all tags"""
     def __init__(self):
@@ -111,15 +196,6 @@ def strip_html(html):
     return s.get_data()
 
 
-def ensure_safe_url(url):
-    """Ensure the GenePattern URL ends with /gp"""
-    if url.endswith('/'):
-        url = url[:-1]
-    if not url.endswith('/gp'):
-        url += '/gp'
-    return url
-
-
 def get_eula(task):
     """Return a dict containing the module's EULA information"""
     return task.dto['eulaInfo']
@@ -128,9 +204,9 @@ def get_eula(task):
 def accept_eula(task):
     """Call the EULA accept endpoint"""
     eula = get_eula(task)
-    requests.put(eula['acceptUrl'], data=eula['acceptData'],
-                 auth=(task.server_data.username, task.server_data.password))
-    task.param_load()
+    sessions.http(eula['acceptUrl']).put(eula['acceptUrl'], data=eula['acceptData'], timeout=sessions.timeout,
+                                         auth=(task.server_data.username, task.server_data.password))
+    param_load(task, refresh=True)
 
 
 def job_params(task):
@@ -140,6 +216,11 @@ def job_params(task):
         return []
 
 
+def job_input_values(info):
+    """Return a map of parameter names -> values from job info queried with includeInputParams=true"""
+    return {name: value for param in info.get('inputParams', []) for name, value in param.items()}
+
+
 def param_groups(task):
     if 'paramGroups' in task.dto: return task.dto['paramGroups']
     else: return []
@@ -152,10 +233,14 @@ def job_group(task):
         return {}
 
 
+def submit_job(session, job_spec):
+    """Submit the job spec without waiting on the job or loading its info, returning the new GPJob"""
+    body = json.dumps({'lsid': job_spec.lsid, 'params': job_spec.params, 'tags': [gp.core.GP_JOB_TAG]}, cls=gp.core.GPJSONEncoder)
+    response = rest_request(session, 'POST', f'{session.url}/rest/v1/jobs', data=body.encode('utf-8'),
+                            headers={'Content-Type': 'application/json'})
+    return GPJob(session, int(response.json()['jobId']))
+
+
 def terminate_job(job):
     url = f'{job.server_data.url}/rest/v1/jobs/{job.job_number}/terminate'
-    request = urllib.request.Request(url, method='DELETE')
-    if job.server_data.authorization_header() is not None:
-        request.add_header('Authorization', job.server_data.authorization_header())
-    request.add_header('User-Agent', 'GenePatternRest')
-    return urllib.request.urlopen(request).code == 200
+    return rest_request(job.server_data, 'DELETE', url).status_code == 200
@@ -1,16 +1,37 @@
 import inspect
-import json
+import itertools
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
-from urllib.request import Request, urlopen
 from urllib.error import HTTPError
-from gp import GPTask
+from gp import GPJob, GPTask
 from IPython.display import display
-from ipywidgets import Output
+from ipywidgets import Output, VBox
 from .jobwidget import GPJobWidget
+from .jobtable import GPJobTable
+from .cache import is_versioned_lsid
+from .instrumentation import traced
 from nbtools import NBTool, UIBuilder, UIOutput, python_safe, EventManager
-from .shim import get_task, get_kinds, get_eula, accept_eula, job_params, param_groups, job_group
+from nbtools.uibuilder import UIBuilderBase
+from .shim import param_load, load_dto, get_info, submit_job, get_kinds, get_eula, accept_eula, job_params, \
+    job_input_values, param_groups, job_group
+from .transfer import upload_file
 from .utils import GENEPATTERN_LOGO, session_color, server_name
+from . import aio
+
+
+EXPAND_EVENT = """
+    const button = this.element.querySelector('.nbtools-collapse');
+    const expand = () => this.model.send({'event': 'method', 'method': 'expand_form'});
+    if (button) button.addEventListener('click', expand, {'once': true});
+    if (!this.model.get('collapsed')) {  // Build the form once the widget is scrolled into view
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) { observer.disconnect(); expand(); }
+        });
+        observer.observe(this.element);
+    }"""
 
 
 class GPTaskWidget(UIBuilder):
@@ -20,6 +41,7 @@ class GPTaskWidget(UIBuilder):
     function_wrapper = None
     parameter_spec = None
     upload_callback = None
+    lazy_args = None
     kwargs = {}
 
     def create_function_wrapper(self, task):
@@ -27,14 +49,18 @@ class GPTaskWidget(UIBuilder):
         if task is None or task.server_data is None: return lambda: None  # Dummy function for null task
         name_map = {}  # Map of Python-safe parameter names to GP parameter names
 
-        # Function for submitting a new GenePattern job based on the task form
-        def submit_job(**kwargs):
+        # Function for building a job spec from Python-safe or GenePattern parameter names
+        def make_spec(**kwargs):
             spec = task.make_job_spec()
             for name, value in kwargs.items():
                 if value is None: value = ''    # Handle the case of blank optional parameters
                 if isinstance(value, float): value = Decimal(str(value)).__format__('f')  # Handle scientific notation
-                spec.set_parameter(name_map[name], value)
-            job = task.server_data.run_job(spec, wait_until_done=False)
+                spec.set_parameter(name_map.get(name, name), value)
+            return spec
+
+        # Function for submitting a new GenePattern job based on the task form
+        def submit_job(**kwargs):
+            job = task.server_data.run_job(make_spec(**kwargs), wait_until_done=False)
             display(GPJobWidget(job, logo='none', color=session_color(self.task.server_data.url, secondary_color=True)))
 
         # Function for adding a parameter with a safe name
@@ -51,10 +77,46 @@ class GPTaskWidget(UIBuilder):
         params_for_job = task.job_params if hasattr(task, 'job_params') else job_params(task)
         for p in task.params + params_for_job: add_param(params, p)  # Loop over all parameters
         submit_job.__signature__ = inspect.Signature(params)
+        submit_job.make_spec = make_spec
 
         return submit_job
 
-    def add_type_spec(self, task_param, param_spec):
+    @traced('GPTaskWidget')
+    def submit_batch(self, param_sets=None, grid=None, max_concurrency=4, **kwargs):
+        """
+        Submit a batch of jobs, such as a parameter sweep, returning a single table widget displaying their status.
+        Jobs are submitted in the background, several at a time.
+        :param param_sets: list of dicts, each mapping parameter names to the values for one job
+        :param grid: dict mapping parameter names to lists of values, a job is submitted for every combination
+        :param max_concurrency: maximum number of jobs to submit simultaneously
+        :param kwargs: parameter values shared by every job in the batch
+        :return: GPJobTable
+        """
+        if self.task is None or self.task.server_data is None: raise RuntimeError('No GenePattern module specified.')
+        if self.task.params is None: param_load(self.task)                      # Load params from GP server
+        wrapper = self.function_wrapper if self.function_wrapper is not None else self.create_function_wrapper(self.task)
+
+        # Assemble the parameter sets, expanding the grid into every combination of values
+        sets = [dict(s) for s in param_sets] if param_sets else [{}]
+        if grid: sets = [{**s, **dict(zip(grid.keys(), values))} for s in sets for values in itertools.product(*grid.values())]
+        sets = [{**kwargs, **s} for s in sets]
+
+        table = GPJobTable(session=self.task.server_data, name=f'{self.task.name} ({len(sets)} jobs)')
+        table.expect(sets)
+
+        @traced('GPTaskWidget')
+        def submit(i):
+            try: table.add_job(submit_job(self.task.server_data, wrapper.make_spec(**sets[i])), sets[i], i)
+            except Exception as e: table.add_failure(sets[i], e, i)
+
+        def submit_all():
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor: list(executor.map(submit, range(len(sets))))
+
+        aio.schedule(aio.run(submit_all))
+        return table
+
+    @staticmethod
+    def add_type_spec(task_param, param_spec):
         if task_param.attributes['type'] == 'java.io.File':
             param_spec['type'] = 'file'
             if task_param.is_choice_param():
@@ -77,27 +139,39 @@ class GPTaskWidget(UIBuilder):
         else: return param_val
 
     def create_param_spec(self, task, kwargs):
-        """Create the display spec for each parameter"""
+        """Create the display spec for each parameter, from the module's compiled spec and any overrides"""
         if task is None: return {}  # Dummy function for null task
-        spec = {}
+        compiled = param_spec_cache.get(task)
         params_for_job = task.job_params if hasattr(task, 'job_params') else job_params(task)
         param_overrides = kwargs.pop('parameters', None)
-        for p in task.params + params_for_job:
-            safe_name = python_safe(p.name)
-            spec[safe_name] = {}
-            spec[safe_name]['default'] = GPTaskWidget.form_value(
+        spec = {}
+        for p, safe_name in zip(task.params + params_for_job, compiled.names):
+            # Defaults are per instance, as they may be set to reproduce a previous job
+            spec[safe_name] = {'default': GPTaskWidget.form_value(
                 GPTaskWidget.override_if_set(safe_name, 'default', param_overrides, p.get_default_value())
-            )
-            spec[safe_name]['description'] = GPTaskWidget.form_value(
-                GPTaskWidget.override_if_set(safe_name, 'description', param_overrides, p.description)
-            )
-            spec[safe_name]['optional'] = GPTaskWidget.override_if_set(safe_name, 'optional', param_overrides,
-                                                                       p.is_optional())
-            spec[safe_name]['kinds'] = GPTaskWidget.override_if_set(safe_name, 'kinds', param_overrides,
-                                                                    p.get_kinds() if hasattr(p, 'get_kinds') else get_kinds(p))
-            self.add_type_spec(p, spec[safe_name])
+            ), **compiled.spec[safe_name]}
+            if param_overrides and safe_name in param_overrides:
+                for attr in ('description', 'optional', 'kinds'):
+                    spec[safe_name][attr] = GPTaskWidget.override_if_set(safe_name, attr, param_overrides, spec[safe_name][attr])
+                spec[safe_name]['description'] = GPTaskWidget.form_value(spec[safe_name]['description'])
         return spec
 
+    @staticmethod
+    def compile_param_spec(task):
+        """Build the display spec for each parameter, except for its default, and the parameter groups"""
+        names, spec = [], {}
+        params_for_job = task.job_params if hasattr(task, 'job_params') else job_params(task)
+        for p in task.params + params_for_job:
+            safe_name = python_safe(p.name)
+            names.append(safe_name)
+            spec[safe_name] = {
+                'description': GPTaskWidget.form_value(p.description),
+                'optional': p.is_optional(),
+                'kinds': p.get_kinds() if hasattr(p, 'get_kinds') else get_kinds(p),
+            }
+            GPTaskWidget.add_type_spec(p, spec[safe_name])
+        return CompiledSpec(names, spec, GPTaskWidget.extract_parameter_groups(task))
+
     @staticmethod
     def extract_parameter_groups(task):
         groups = task.param_groups if hasattr(task, 'param_groups') else param_groups(task)     # Get param groups
@@ -114,11 +188,12 @@ class GPTaskWidget(UIBuilder):
         """Create an upload callback to pass to file input widgets"""
         def genepattern_upload_callback(values):
             try:
+                urls = []
                 for k in values:
                     path = os.path.realpath(k)
-                    gpfile = self.task.server_data.upload_file(k, path)
+                    urls.append(upload_file(self.task.server_data, path, k))
                     os.remove(path)
-                    return gpfile.get_url()
+                return urls[0] if len(urls) == 1 else urls
             except Exception as e:
                 self.error = f"Error encountered uploading file: {e}"
         return genepattern_upload_callback
@@ -133,7 +208,8 @@ class GPTaskWidget(UIBuilder):
         self.display_footer = False
         self.error = error_message
 
-    def __init__(self, task=None, origin='', id='', **kwargs):
+    @traced('GPTaskWidget')
+    def __init__(self, task=None, origin='', id='', lazy=False, **kwargs):
         """Initialize the task widget"""
         self.task = task
         self.kwargs = kwargs
@@ -142,32 +218,74 @@ class GPTaskWidget(UIBuilder):
 
         if self.task is None or self.task.server_data is None:  # Set the right look and error message if task is None
             self.handle_error_task('No GenePattern module specified.', **kwargs)
+        elif lazy:  # Display a lightweight header, deferring the form until the widget is expanded
+            self.lazy_init(origin, id, **kwargs)
         elif self.is_java_visualizer():  # Checks if deprecated visualizer and displays an error message
             self.handle_error_task('Java-based visualizers are deprecated in GenePattern and will not function in Jupyter', name=task.name, **kwargs)
         else:
-            if self.task.params is None: self.task.param_load()                 # Load params from GP server
-            self.function_wrapper = self.create_function_wrapper(self.task)     # Create run task function
-            self.parameter_spec = self.create_param_spec(self.task, kwargs)     # Create the parameter spec
-            self.session_color = session_color(self.task.server_data.url)       # Set the session color
-            ui_args = {                                                         # Assemble keyword arguments
-                'color': self.session_color,
-                'id': id,
-                'license': self.add_license(),
-                'license_callback': self.generate_license_callback(),
-                'logo': GENEPATTERN_LOGO,
-                'origin': origin,
-                'parameter_groups': GPTaskWidget.extract_parameter_groups(self.task),
-                'parameters': self.parameter_spec,
-                'subtitle': f'Version {task.version}',
-                'upload_callback': self.generate_upload_callback(),
-            }
-            ui_args = { **ui_args, **kwargs }                                   # Merge kwargs (allows overrides)
+            ui_args = self.create_ui_args(origin, id, kwargs)                  # Build the form
             UIBuilder.__init__(self, self.function_wrapper, **ui_args)          # Initiate the widget
             self.attach_menu_items()
 
         # Register the event handler for GP login
         EventManager.instance().register("gp.login", self.login_callback)
 
+    def create_ui_args(self, origin, id, kwargs):
+        """Load the task and assemble the keyword arguments for building the form"""
+        if self.task.params is None: param_load(self.task)                     # Load params from GP server
+        self.function_wrapper = self.create_function_wrapper(self.task)         # Create run task function
+        self.parameter_spec = self.create_param_spec(self.task, kwargs)         # Create the parameter spec
+        self.session_color = session_color(self.task.server_data.url)           # Set the session color
+        ui_args = {                                                             # Assemble keyword arguments
+            'color': self.session_color,
+            'id': id,
+            'license': self.add_license(),
+            'license_callback': self.generate_license_callback(),
+            'logo': GENEPATTERN_LOGO,
+            'origin': origin,
+            'parameter_groups': param_spec_cache.get(self.task).parameter_groups(),
+            'parameters': self.parameter_spec,
+            'subtitle': f'Version {self.task.version}',
+            'upload_callback': self.generate_upload_callback(),
+        }
+        return { **ui_args, **kwargs }                                          # Merge kwargs (allows overrides)
+
+    def lazy_init(self, origin, id, **kwargs):
+        """Display a header for the task using only the metadata from the task list. The parameter spec,
+           choices and license are built when the widget is first expanded, or first scrolled into view
+           if not collapsed."""
+        self.lazy_args = (origin, id)
+        ui_args = {
+            'collapsed': True,
+            'color': session_color(self.task.server_data.url),
+            'description': self.task.description or '',
+            'events': {'load': EXPAND_EVENT},
+            'id': id,
+            'logo': GENEPATTERN_LOGO,
+            'name': self.task.name or self.task.uri,
+            'origin': origin,
+            'subtitle': f'Version {self.task.version}' if self.task.version else '',
+        }
+        form_only = ['parameters', 'parameter_groups']                          # Overrides applied upon expansion
+        ui_args = { **ui_args, **{k: v for k, v in kwargs.items() if k not in form_only} }
+        UIBuilder.__init__(self, lambda: None, **ui_args)
+
+    @traced('GPTaskWidget')
+    def expand_form(self):
+        """Build the full form of a lazily initialized widget. Called by the client when first expanded."""
+        if self.function_wrapper is not None or self.lazy_args is None: return  # Form already built
+        if self.is_java_visualizer():
+            self.error = 'Java-based visualizers are deprecated in GenePattern and will not function in Jupyter'
+            return
+
+        # Create the form and swap it in for the placeholder
+        ui_args = { **self.create_ui_args(*self.lazy_args, dict(self.kwargs)), 'collapsed': False }
+        form = UIBuilderBase(self.function_wrapper, _parent=self, **ui_args)
+        self.form, self.output = form, form.output
+        self.children = [form, form.output]
+        self._apply_overrides(**ui_args)
+        self.attach_menu_items()
+
     def add_license(self):
         if not self.task or not self.task.json: return {}   # Skip if there is no task json to parse
         eula = self.task.get_eula() if hasattr(self.task, 'get_eula') else get_eula(self.task)
@@ -206,7 +324,7 @@ class GPTaskWidget(UIBuilder):
         else: return ''
 
     def is_java_visualizer(self):
-        if self.task.params is None: self.task.param_load()  # Load params from GP server
+        if self.task.params is None: param_load(self.task)  # Load params from GP server
         return 'Visualizer' in self.task.dto['categories']
 
     def login_callback(self, data):
@@ -215,17 +333,22 @@ class GPTaskWidget(UIBuilder):
                defined GPTaskWidget cells, this additional callback is necessary to ensure that they render
                appropriately upon login. This is why we check for self.error, as we can safely skip all other cells."""
         if self.task is not None and self.task.server_data is None and self.error is not None:
-            task = data.get_task(self.task.uri) if hasattr(data, 'get_task') else get_task(data, self.task.uri)
-            task.param_load()  # Get the GPTask object and load its data
-
             # Create a new task widget and close the old unauthenticated one
-            with self.output:
-                display(GPTaskWidget(task, **self.kwargs))
-                self.close()
+            def display_task(task):
+                with self.output:
+                    display(GPTaskWidget(task, **self.kwargs))
+                    self.close()
+
+            # Get the GPTask object and load its data without blocking the kernel
+            async def load():
+                return await aio.param_load(await aio.get_task(data, self.task.uri))
+            def display_error(e): self.error = f'Error loading module {self.task.uri}: {e}'
+            aio.schedule(load(), display_task, display_error)
 
 
 class TaskTool(NBTool):
-    """Tool wrapper for the authentication widget"""
+    """Tool wrapper for the task widget. Widgets loaded as tools defer building their forms until they are
+       scrolled into view, so that notebooks with many module cells open quickly."""
 
     def __init__(self, server_name, task):
         NBTool.__init__(self)
@@ -233,50 +356,123 @@ class TaskTool(NBTool):
         self.id = task.lsid
         self.name = task.name
         self.description = task.description
-        self.load = lambda **kwargs: GPTaskWidget(task, id=self.id, origin=self.origin, **kwargs)
-
-
-def reproduce_job(sessions, session_index, job_number):
+        self.load = lambda **kwargs: GPTaskWidget(task, id=self.id, origin=self.origin, **{'lazy': True, 'collapsed': False, **kwargs})
+
+
+class CompiledSpec:
+    """The parameter spec and groups derived from a module's parameters, shared by all of its widgets"""
+
+    def __init__(self, names, spec, groups):
+        self.names = names      # Python-safe parameter names, in the order of the module's parameters
+        self.spec = spec        # Map of Python-safe names -> display spec without defaults, must not be modified
+        self.groups = groups    # Parameter groups
+
+    def parameter_groups(self):
+        """Return a copy of the parameter groups that the widget may modify"""
+        return [{**group, 'parameters': list(group['parameters'])} if 'parameters' in group else dict(group) for group in self.groups]
+
+
+class ParamSpecCache:
+    """
+    In-memory cache of the parameter specs compiled from each module's parameters, keyed by server and LSID,
+    so that building the spec and the choice dictionaries only happens the first time a module is opened.
+    Only versioned LSIDs are cached, as the parameters of a version of a module never change.
+    """
+    max_entries = 200       # Maximum number of compiled modules kept
+
+    def __init__(self):
+        self.specs = OrderedDict()  # Map of (server, LSID) -> CompiledSpec, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, task):
+        """Return the compiled spec for the task, compiling it if not cached"""
+        if not is_versioned_lsid(task.lsid): return GPTaskWidget.compile_param_spec(task)
+        key = (task.server_data.url.rstrip('/'), task.lsid)
+        with self.lock:
+            if key in self.specs:
+                self.specs.move_to_end(key)
+                return self.specs[key]
+
+        compiled = GPTaskWidget.compile_param_spec(task)
+        with self.lock:
+            self.specs[key] = compiled
+            while len(self.specs) > self.max_entries: self.specs.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self.lock: self.specs.clear()
+
+
+"""
+GenePattern compiled parameter spec cache singleton
+"""
+param_spec_cache = ParamSpecCache()
+
+
+def reproduce_job(sessions, session_index, job_number, lsid=None):
+    """Return a task widget with its parameters set to reproduce the job. If the module's LSID is
+       provided, the job info and the module are fetched concurrently."""
+    @traced('reproduce_job')
+    def create_task(session):
+        return GPTaskWidget(reproduce_tasks(session, [job_number], [lsid])[0])
+    return create_when_authenticated(sessions, session_index, f'module: {{origin}} | {job_number}', create_task)
+
+
+def reproduce_jobs(sessions, session_index, job_numbers):
+    """Return a widget containing a task widget to reproduce each of the jobs, for example every step of
+       a pipeline. All jobs are fetched concurrently and each module is only loaded once."""
+    @traced('reproduce_job')
+    def create_tasks(session):
+        return VBox([GPTaskWidget(task) for task in reproduce_tasks(session, job_numbers)])
+    return create_when_authenticated(sessions, session_index, f'jobs: {{origin}} | {len(job_numbers)} jobs', create_tasks)
+
+
+def reproduce_tasks(session, job_numbers, lsids=None):
+    """Return a GPTask for each job, with its parameter defaults set to the job's input values.
+       Jobs, and the modules of any jobs whose LSID is already known, are fetched concurrently."""
+    lsids = lsids if lsids is not None else [None] * len(job_numbers)
+    templates = {lsid: aio.submit(param_load, GPTask(session, lsid)) for lsid in set(lsids) if lsid}
+    futures = [aio.submit(get_info, GPJob(session, n)) for n in job_numbers]
+
+    # Load any modules that weren't known as soon as each job's info is received
+    for future in as_completed(futures):
+        lsid = future.result().info['taskLsid']
+        if lsid not in templates: templates[lsid] = aio.submit(param_load, GPTask(session, lsid))
+    infos = [future.result().info for future in futures]
+
+    tasks = []
+    for info in infos:
+        task = GPTask(session, info['taskLsid'])
+        load_dto(task, templates[info['taskLsid']].result().json)  # Each widget needs its own copy of the params
+        values = job_input_values(info)                             # Match the job's values to the params by name
+        for param in task.params:
+            if param.name in values: param.attributes['default_value'] = values[param.name]
+        tasks.append(task)
+    return tasks
+
+
+def create_when_authenticated(sessions, session_index, label, create):
+    """Return the widget made by create(session), or if not yet logged in, a placeholder that is replaced
+       with the widget once the server's modules are registered"""
     session = sessions.make(session_index)
     origin = server_name(session.url)
     needs_rendered = True
-
-    # Create the task widget, either immediately or upon login callback
-    def create_task():
-        session = sessions.make(session_index)          # Retrieve session again, necessary if run from login callback
-        request = Request(session.url + "/rest/v1/jobs/" + str(job_number) + "?includeInputParams=true")
-        if session.authorization_header() is not None:  # Make authorized call to GenePattern REST API
-            request.add_header('Authorization', session.authorization_header())
-        request.add_header('User-Agent', 'GenePatternRest')
-        response = urlopen(request)                     # Get the response
-        json_str = response.read().decode('utf-8')      # Deal with the JSON payload
-        json_dict = json.loads(json_str)
-        task = GPTask(session, json_dict['taskLsid'])
-        task.param_load()                               # Retrieve task parameters
-        params = task.get_parameters()
-        for i in range(len(params)):
-            task_param = params[i]
-            custom_value = json_dict['inputParams'][i]  # Set the values to reproduce the original job
-            task_param.attributes['default_value'] = custom_value[list(custom_value)[0]]
-        return GPTaskWidget(task)                       # Return widget for display
+    if session.username: return create(session)
 
     # Render the widget upon callback from 'nbtools.register'
-    def render_task(data):
+    def render(data):
         nonlocal needs_rendered
         if needs_rendered and 'origin' in data and data['origin'] == origin:
-            task_widget = create_task()             # Create the task widget
-            placeholder.close()                     # Remove the placeholder widget
-            with output: display(task_widget)       # Display the task widget
-            needs_rendered = False                  # Only display once
+            widget = create(sessions.make(session_index))   # Retrieve session again, now that it is logged in
+            placeholder.close()                             # Remove the placeholder widget
+            with output: display(widget)                    # Display the widget
+            needs_rendered = False                          # Only display once
 
-    if not session.username:                        # If not logged in, display placeholder widget
-        output = Output()  # Output widget and placeholder
-        placeholder = UIOutput(name='Cannot find module', error=f'Cannot find module: {origin} | {job_number}')
-        output.append_display_data(placeholder)
-        EventManager.instance().register("nbtools.register", render_task)  # Register the callback with event manager
-        return output                               # Return widget for display
-    else:
-        return create_task()
+    output = Output()  # Output widget and placeholder
+    placeholder = UIOutput(name='Cannot find module', error=f'Cannot find {label.format(origin=origin)}')
+    output.append_display_data(placeholder)
+    EventManager.instance().register("nbtools.register", render)  # Register the callback with event manager
+    return output
 
 
 def spec_to_kwargs(kwargs):
@@ -300,7 +496,7 @@ def load_task(sessions, session_index, name_or_lsid):
     session = sessions.make(session_index)          # Get the GenePattern session
     task = GPTask(session, name_or_lsid)            # Initialize a task object
 
-    try: task.param_load()                          # Query the GenePattern server for the module's metadata
+    try: param_load(task)                           # Query the GenePattern server for the module's metadata
     except HTTPError: return None                   # Return None if no module available
 
     return GPTaskWidget(task)                       # Return the task widget
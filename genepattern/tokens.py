@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import json
+import os
+import requests
+import threading
+import time
+import urllib.parse
+from .cache import cache_dir
+from .instrumentation import traced
+from .sessions import session as sessions
+from .utils import ensure_safe_url
+
+
+def request_token(session, refresh_token=None):
+    """
+    Request an OAuth token from the GenePattern server, using the session's password or a refresh token.
+    Returns the token response, including the access_token and, if provided by the server, expires_in.
+    """
+    safe_url = ensure_safe_url(session.url)
+    safe_username = urllib.parse.quote(session.username)
+    if refresh_token: grant = f"grant_type=refresh_token&refresh_token={urllib.parse.quote(refresh_token)}"
+    else: grant = f"grant_type=password&username={safe_username}&password={urllib.parse.quote(session.password)}"
+
+    url = f"{safe_url}/rest/v1/oauth2/token?{grant}&client_id=GenePatternNotebook-{safe_username}"
+    try:
+        response = sessions.http(url).post(url, timeout=sessions.timeout)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.Timeout:
+        raise TimeoutError('Connection timed out attempting to contact GenePattern server')
+    except requests.exceptions.TooManyRedirects:
+        raise TimeoutError('Bad GenePattern server URL')
+    except requests.exceptions.RequestException as e:
+        raise TimeoutError('Invalid username or password')
+
+
+class Token:
+    """An OAuth access token, when it expires and the credentials it was issued for"""
+
+    def __init__(self, access_token, expires_in=None, refresh_token=None, password_hash=None, salt=None, issued=None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.issued = issued if issued is not None else time.time()                         # Epoch time the token was issued
+        self.expires = self.issued + float(expires_in) if expires_in is not None else None  # Epoch expiry, None if unknown
+        self.salt = salt if salt is not None else os.urandom(16).hex()
+        self.password_hash = password_hash
+
+    def remaining(self):
+        """Return the seconds until the token expires, or None if the expiry is unknown"""
+        return self.expires - time.time() if self.expires is not None else None
+
+    def expired(self, margin=0.0):
+        return self.expires is not None and self.remaining() <= margin
+
+    def stale(self, fraction):
+        """Is the token within the given fraction of its lifetime of expiring"""
+        return self.expires is not None and self.remaining() <= (self.expires - self.issued) * fraction
+
+    def matches(self, password):
+        """Was the token issued for this password"""
+        return self.password_hash is not None and hmac.compare_digest(self.password_hash, hash_password(password, self.salt))
+
+    def to_dict(self):
+        return {'access_token': self.access_token, 'refresh_token': self.refresh_token, 'issued': self.issued,
+                'expires_in': self.expires - self.issued if self.expires is not None else None,
+                'password_hash': self.password_hash, 'salt': self.salt}
+
+
+def hash_password(password, salt):
+    """Return a salted hash of the password, so that tokens are never reused for the wrong credentials"""
+    return hashlib.pbkdf2_hmac('sha256', (password or '').encode('utf-8'), bytes.fromhex(salt), 100000).hex()
+
+
+class TokenManager:
+    """
+    Caches OAuth tokens per GenePattern server and user, shared by all sessions and widgets. Tokens nearing
+    expiry are refreshed in the background, and concurrent requests for a new token are collapsed into a
+    single request. Tokens may optionally be persisted, readable only by the user, so that they survive
+    kernel restarts.
+    """
+    refresh_fraction = 0.2      # Refresh in the background once this fraction of a token's lifetime remains
+    expiry_margin = 10          # Seconds before expiry a token is no longer handed out
+    persist = os.environ.get('GENEPATTERN_PERSIST_TOKENS', '').lower() in ('1', 'true', 'yes')
+
+    def __init__(self, path=None):
+        self.path = path if path else cache_dir('tokens')
+        self.tokens = {}                # Map of (server, username) -> Token
+        self.verified = {}              # Map of (server, username) -> password the cached token was verified against
+        self.locks = {}                 # Map of (server, username) -> lock held while requesting a token
+        self.refreshing = set()         # Keys with a background refresh in progress
+        self.lock = threading.Lock()    # Held while reading or modifying the maps above
+
+    @staticmethod
+    def key(session):
+        return ensure_safe_url(session.url), session.username
+
+    def token(self, session):
+        """Return a valid access token for the session, only contacting the server if no usable token is cached"""
+        key = self.key(session)
+        token = self.cached(key, session.password)
+        if token is None or token.expired(self.expiry_margin): return self.refresh(session, token).access_token
+        if token.stale(self.refresh_fraction): self.refresh_in_background(session)
+        return token.access_token
+
+    def cached(self, key, password):
+        """Return the cached token for the key, if it was issued for the password, loading it from disk if needed"""
+        with self.lock: token, verified = self.tokens.get(key), self.verified.get(key)
+        if token is None and self.persist: token, verified = self.load(key), None
+        if token is None: return None
+
+        # Verifying the password hash is deliberately slow, so only verify once per password, outside the lock
+        if verified != password and not token.matches(password): return None
+        with self.lock:
+            if self.tokens.get(key, token) is token:  # Unless replaced by a concurrent refresh
+                self.tokens[key] = token
+                self.verified[key] = password
+        return token
+
+    def refresh(self, session, previous=None):
+        """Request a new token, unless another thread already did so while waiting for the lock"""
+        key = self.key(session)
+        with self.lock: lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            with self.lock: current, verified = self.tokens.get(key), self.verified.get(key)
+            if current is not None and current is not previous and verified == session.password \
+                    and not current.stale(self.refresh_fraction):
+                return current  # Refreshed by another caller
+
+            response = None
+            if previous is not None and previous.refresh_token and not previous.expired():
+                try: response = request_token(session, refresh_token=previous.refresh_token)
+                except TimeoutError: pass  # Fall back to the password
+            if response is None: response = request_token(session)
+
+            salt = os.urandom(16).hex()
+            token = Token(response['access_token'], response.get('expires_in'), response.get('refresh_token'),
+                          hash_password(session.password, salt), salt)
+            with self.lock:
+                self.tokens[key] = token
+                self.verified[key] = session.password
+            if self.persist: self.save(key, token)
+            return token
+
+    def refresh_in_background(self, session):
+        """Refresh the session's token in a background thread, if a refresh is not already underway"""
+        key = self.key(session)
+        with self.lock:
+            if key in self.refreshing: return
+            self.refreshing.add(key)
+            previous = self.tokens.get(key)
+
+        @traced('TokenManager')
+        def refresh():
+            try: self.refresh(session, previous)
+            except Exception: pass  # The current token remains valid, the next request will try again
+            finally:
+                with self.lock: self.refreshing.discard(key)
+        threading.Thread(target=refresh, name='genepattern-token', daemon=True).start()
+
+    def invalidate(self, session):
+        """Forget the session's token, for example after the server rejects it"""
+        key = self.key(session)
+        with self.lock:
+            self.tokens.pop(key, None)
+            self.verified.pop(key, None)
+        if self.persist:
+            try: os.remove(self._file(key))
+            except OSError: pass
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha256('|'.join(key).encode('utf-8')).hexdigest() + '.json')
+
+    def load(self, key):
+        """Load the persisted token for the key, or None if there isn't a valid one"""
+        try:
+            with open(self._file(key), 'r') as f: entry = json.load(f)
+            token = Token(entry['access_token'], entry['expires_in'], entry['refresh_token'],
+                          entry['password_hash'], entry['salt'], entry['issued'])
+            return None if token.expired(self.expiry_margin) else token
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, key, token):
+        """Persist the token to a file readable only by the current user"""
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            temp_file = f'{self._file(key)}.{threading.get_ident()}.tmp'
+            with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                json.dump(token.to_dict(), f)
+            os.replace(temp_file, self._file(key))
+        except OSError:
+            pass  # Tokens still work, they just won't survive a restart
+
+
+"""
+GenePattern token manager singleton
+"""
+token_manager = TokenManager()
@@ -0,0 +1,22 @@
+from IPython import get_ipython
+from nbtools import ToolManager, NBTool
+
+
+class AuthenticationTool(NBTool):
+    """Tool wrapper for the authentication widget"""
+    origin = '+'
+    id = 'authentication'
+    name = 'GenePattern Login'
+    description = 'Log into a GenePattern server'
+
+    def load(self):
+        from .authwidget import GPAuthWidget  # Widget modules are only imported once the tool is opened
+        return GPAuthWidget()
+
+
+def register_tools():
+    """Register the authentication widget with the ToolManager, if not already registered"""
+    if getattr(get_ipython(), 'kernel', None) is None: return  # Not running in a kernel, for example in a script
+    tools = ToolManager.instance().tools
+    if AuthenticationTool.id not in tools.get(AuthenticationTool.origin, {}):
+        ToolManager.instance().register(AuthenticationTool())
@@ -0,0 +1,224 @@
+import base64
+import contextvars
+import hashlib
+import json
+import math
+import os
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from .cache import cache_dir
+from .shim import rest_request
+
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read from or written to the network at a time
+
+
+def download_file(session, url, path, expected_size=None, checksum=None, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Stream the file at the URL to the local path, one chunk at a time. Data is written to a .part file,
+    which is resumed with an HTTP Range request if a previous download was interrupted. Once complete,
+    the file size and checksum are verified before the file is moved to its final path.
+    :param session: GPServer used to authenticate the request
+    :param url: URL of the file to download
+    :param path: local path to write the file to
+    :param expected_size: size in bytes the file should be, if known
+    :param checksum: optional (algorithm, hex digest) tuple to verify, for example ('md5', '...')
+    :param progress: optional callback, called with the bytes downloaded and the total bytes (or None)
+    :param chunk_size: bytes to read at a time
+    :return: the local path
+    """
+    partial = f'{path}.part'
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers = {'Accept-Encoding': 'identity'}  # Sizes and checksums are of the raw file
+    if offset: headers['Range'] = f'bytes={offset}-'
+    content_md5 = None
+
+    try:
+        with rest_request(session, 'GET', url, headers=headers, stream=True) as response:
+            if response.status_code != 206: offset = 0  # Server ignored the range, start over
+            content_md5 = response.headers.get('Content-MD5')
+            length = response.headers.get('Content-Length')
+            total = expected_size if expected_size is not None else (offset + int(length) if length else None)
+
+            with open(partial, 'ab' if offset else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if progress: progress(offset, total)
+    except HTTPError as e:
+        if e.code != 416 or not offset: raise e  # Range not satisfiable, the partial file is already complete
+        total = expected_size
+
+    # Verify the download, keeping the partial file to resume from if it is short
+    size = os.path.getsize(partial)
+    if total is not None and size < total:
+        raise IOError(f'Download of {url} incomplete, received {size} of {total} bytes')
+    if total is not None and size > total:
+        os.remove(partial)
+        raise IOError(f'Download of {url} corrupt, received {size} bytes but expected {total}')
+    if checksum is None and content_md5: checksum = ('md5', base64.b64decode(content_md5).hex())
+    if checksum is not None and file_digest(partial, checksum[0]) != checksum[1].lower():
+        os.remove(partial)
+        raise IOError(f'Download of {url} corrupt, {checksum[0]} checksum does not match')
+
+    os.replace(partial, path)
+    return path
+
+
+def download_files(session, files, directory='.', max_workers=4, progress=None, cache=None):
+    """
+    Concurrently download a list of (url, file name, expected size) tuples to the directory.
+    :param session:
+    :param files:
+    :param directory:
+    :param max_workers: maximum number of simultaneous downloads
+    :param progress: optional callback, called with the file name, bytes downloaded and total bytes
+    :param cache: optional FileCache to copy cacheable files from, so that they are only downloaded once
+    :return: list of local paths
+    """
+    def download(file):
+        url, name, size = file
+        callback = (lambda done, total: progress(name, done, total)) if progress else None
+        if cache is not None and cache.cacheable(session, url):
+            return cache.copy(session, url, os.path.join(directory, name), expected_size=size, progress=callback)
+        return download_file(session, url, os.path.join(directory, name), expected_size=size, progress=callback)
+
+    context = contextvars.copy_context()  # Attribute the requests to the caller
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda file: context.copy().run(download, file), files))
+
+
+def file_digest(path, algorithm='md5', chunk_size=CHUNK_SIZE):
+    """Return the hex digest of the local file, reading it one chunk at a time"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+PART_SIZE = 10 * 1024 * 1024  # Bytes per part of a multipart upload
+
+
+def upload_file(session, path, name=None, part_size=PART_SIZE, max_workers=4, retries=3, progress=None):
+    """
+    Upload the local file to the GenePattern server, returning the URL of the uploaded file.
+    Files already uploaded with the same content and name are not sent again. Files larger than one part are
+    uploaded in parts, several at a time, with each part retried on failure. Progress of multipart
+    uploads is saved locally, so an interrupted upload resumes where it left off, even after a kernel restart.
+    :param session: GPServer to upload to
+    :param path: local path of the file
+    :param name: name of the file on the server, defaults to the local file name
+    :param part_size: bytes per part
+    :param max_workers: maximum number of parts to upload simultaneously
+    :param retries: number of attempts for each part
+    :param progress: optional callback, called with the bytes uploaded and the total bytes
+    :return: URL of the uploaded file
+    """
+    name = name if name else os.path.basename(path)
+    digest = file_digest(path, 'sha256')
+    state = UploadState(session, digest, name)
+
+    # If this content has already been uploaded under this name and is still on the server, return its URL
+    if state.get('url') and file_exists(session, state.get('url')):
+        return state.get('url')
+
+    size = os.path.getsize(path)
+    if size <= part_size: url = upload_single(session, path, name)
+    else: url = upload_multipart(session, path, name, state, size, part_size, max_workers, retries, progress)
+
+    state.clear()
+    state.update(url=url)
+    return url
+
+
+def upload_single(session, path, name):
+    """Upload the file in a single, streamed request to the job input endpoint"""
+    with open(path, 'rb') as f:
+        response = rest_request(session, 'POST', f'{session.url}/rest/v1/data/upload/job_input?name={quote(name)}', data=f)
+    if not response.headers.get('Location'): raise IOError(f'Upload of {name} failed, no file location returned')
+    return response.headers['Location']
+
+
+def upload_multipart(session, path, name, state, size, part_size, max_workers, retries, progress):
+    """Upload the file to the user's upload directory in parts, resuming any previously interrupted upload"""
+    parts = math.ceil(size / part_size)
+    server_path = f'notebook_uploads/{state.digest[:16]}/{name}'  # Content-addressed, so uploads never collide
+    endpoint = f'{session.url}/rest/v1/upload/multipart/'
+
+    # Begin a new upload unless a matching one can be resumed
+    if not state.get('token') or state.get('path') != server_path or state.get('parts') != parts:
+        response = rest_request(session, 'POST', f'{endpoint}?path={quote(server_path)}&parts={parts}&fileSize={size}')
+        state.clear()
+        state.update(token=response.json()['token'], path=server_path, parts=parts, done=[])
+    query = f'path={quote(server_path)}&token={quote(state.get("token"))}&parts={parts}'
+    done = set(state.get('done'))
+    lock = threading.Lock()
+
+    def send(index):
+        with open(path, 'rb') as f:
+            f.seek(index * part_size)
+            data = f.read(part_size)
+        for attempt in range(retries):
+            try:
+                rest_request(session, 'PUT', f'{endpoint}?{query}&index={index}', data=data)
+                break
+            except (HTTPError, requests.RequestException) as e:
+                if attempt == retries - 1: raise e
+                time.sleep(2 ** attempt)
+        with lock:
+            done.add(index)
+            state.update(done=sorted(done))
+            if progress: progress(min(len(done) * part_size, size), size)
+
+    context = contextvars.copy_context()  # Attribute the requests to the caller
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda index: context.copy().run(send, index), [i for i in range(parts) if i not in done]))
+
+    # Assemble the parts on the server
+    rest_request(session, 'POST', f'{endpoint}assemble/?{query}')
+    return f'{session.url}/users/{quote(session.username)}/{server_path}'
+
+
+def file_exists(session, url):
+    """Does the file at the URL exist on the server"""
+    try:
+        rest_request(session, 'HEAD', url, allow_redirects=True)
+        return True
+    except (HTTPError, requests.RequestException):
+        return False
+
+
+class UploadState:
+    """Upload state for a file's content and name, persisted locally so uploads can be deduplicated and resumed"""
+
+    def __init__(self, session, digest, name):
+        self.digest = digest
+        key = f'{session.url.rstrip("/")}|{session.username}|{digest}|{name}'
+        self.file = os.path.join(cache_dir('uploads'), hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+        try:
+            with open(self.file, 'r') as f: self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def get(self, key):
+        return self.state.get(key)
+
+    def update(self, **kwargs):
+        self.state.update(kwargs)
+        self.save()
+
+    def clear(self):
+        self.state = {}
+        self.save()
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            with open(self.file, 'w') as f: json.dump(self.state, f)
+        except OSError:
+            pass  # Uploads still work, they just can't be resumed or deduplicated
@@ -1,8 +1,9 @@
-from gp import GPFile
+import threading
+import time
+from calendar import timegm
 from .sessions import session as sessions
-import requests
 from urllib.request import urlopen
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 
 
 GENEPATTERN_SERVERS = {
@@ -43,15 +44,25 @@ def session_color(index=0, secondary_color=False):
 def filelike(file_url, session_index=None):
     """
     Create a file-like object for the given URL.
-    If it is a GenePattern URL, return a GPFile (file-like) object with embedded auth.
+    If it is a GenePattern URL, return a GPFile (file-like) object with embedded auth. The outputs of
+    completed jobs are served from the local file cache through a memory-mapped file, so are downloaded once.
     Optionally provide a GenePattern session identifier, otherwise extract it from the URL.
     """
-    if session_index is None:  # If no session_index specified, extract it from the URL
-        session_index = f'{urlparse(file_url).scheme}://{urlparse(file_url).netloc}/gp'
-    session = sessions.get(session_index)  # Get the GenePattern session
+    from .filecache import CachedGPFile    # Imported here to avoid a circular import
+    if session_index is None: session = sessions.find(file_url)  # If no session_index specified, find it from the URL
+    else: session = sessions.get(session_index)                     # Otherwise, get the specified GenePattern session
     if session is None:                    # If no session, assume this isn't a GenePattern URL
         return urlopen(file_url)           # Return a generic file-like pointing to the response
-    return GPFile(session, file_url)       # Otherwise, return a GPFile object
+    return CachedGPFile(session, file_url) # Otherwise, return a cached GPFile object
+
+
+def ensure_safe_url(url):
+    """Ensure the GenePattern URL ends with /gp"""
+    if url.endswith('/'):
+        url = url[:-1]
+    if not url.endswith('/gp'):
+        url += '/gp'
+    return url
 
 
 def is_url(url_str):
@@ -60,10 +71,41 @@ def is_url(url_str):
     return bool(result.scheme and result.netloc)
 
 
-def redirect_url(url, token=None):
-    """Get the end URL of an HTTP redirect, or return initial URL if no redirect"""
+REDIRECT_TTL = 300      # Seconds to remember a resolved redirect, unless the target URL expires sooner
+REDIRECT_MARGIN = 30    # Seconds before a pre-signed URL expires that it is no longer reused
+
+_redirects = {}         # Map of (server URL, username, URL) -> (resolved URL, monotonic expiry time)
+_redirects_lock = threading.Lock()
+
+
+def redirect_url(url, token=None, session=None):
+    """Get the end URL of an HTTP redirect, or return initial URL if no redirect. Results are cached per session
+       until they expire, as the redirect may depend on the user whose token resolved it."""
+    key = (session.url, session.username, url) if session is not None else (None, token, url)
+    with _redirects_lock:
+        cached = _redirects.get(key)
+        if cached and cached[1] > time.monotonic(): return cached[0]
+
     headers = {'User-Agent': 'GenePatternRest'}
     if token: headers['Authorization'] = f'Bearer {token}'
-    response = requests.head(url, headers=headers, allow_redirects=False)
-    if 'Location' in response.headers: return response.headers['Location']
-    else: return url
+    response = sessions.http(url).head(url, headers=headers, allow_redirects=False, timeout=sessions.timeout)
+    location = response.headers['Location'] if 'Location' in response.headers else url
+
+    with _redirects_lock:
+        for expired in [k for k, v in _redirects.items() if v[1] <= time.monotonic()]: del _redirects[expired]  # Evict expired
+        _redirects[key] = (location, time.monotonic() + redirect_ttl(location))
+    return location
+
+
+def redirect_ttl(url):
+    """Return the seconds a resolved redirect may be reused, honoring the expiry of pre-signed S3 URLs"""
+    params = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    try:
+        if 'x-amz-date' in params and 'x-amz-expires' in params:  # Signature version 4
+            expires = timegm(time.strptime(params['x-amz-date'], '%Y%m%dT%H%M%SZ')) + int(params['x-amz-expires'])
+        elif 'expires' in params:  # Signature version 2 and CloudFront, seconds since the epoch
+            expires = int(params['expires'])
+        else: return REDIRECT_TTL
+    except ValueError:
+        return 0  # Expiry can't be determined, don't reuse
+    return max(min(expires - time.time() - REDIRECT_MARGIN, REDIRECT_TTL), 0)
@@ -26,15 +26,15 @@ setup(name='genepattern-notebook',
           'Intended Audience :: Developers',
           'Topic :: Scientific/Engineering :: Bio-Informatics',
           'License :: OSI Approved :: BSD License',
-          'Programming Language :: Python :: 3.6',
           'Programming Language :: Python :: 3.7',
           'Programming Language :: Python :: 3.8',
           'Programming Language :: Python :: 3.9',
           'Framework :: Jupyter',
       ],
+      python_requires='>=3.7',
       install_requires=[
           'genepattern-python>=1.4.2',
-          'nbtools>=23.4',
+          'nbtools>=24.4',
           'notebook>=5.0.0',
           'ipywidgets>=7.0.0',
           'pandas',